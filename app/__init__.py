@@ -1,14 +1,17 @@
-import os
-from flask import Flask, jsonify
-from flask_jwt_extended import JWTManager
+from flask import Flask
+from flask_jwt_extended import JWTManager, jwt_required
 from flask_cors import CORS
 
-from app.models import RevokedToken
 from app.models import db
+from app.database import LAST_WRITE_HEADER
 from app.business.views import business_api
+from app.encoding import jsonify, response_encoder
+from app.hashing import password_hasher
+from app.mailer import mail_queue
 from app.reviews.views import reviews_api
+from app.revocation import revocation_cache
+from app.search import business_search
 from app.users.views import user_api
-from app.utils import mail
 
 from config import app_config
 
@@ -16,19 +19,16 @@ from config import app_config
 def create_app(config_object):
 
     app = Flask(__name__, instance_relative_config=True)
-    CORS(app)
+    CORS(app, expose_headers=[LAST_WRITE_HEADER])
     app.config.from_object(app_config[config_object])
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-    app.config.update(
-        MAIL_SERVER='smtp.gmail.com',
-        MAIL_PORT=465,
-        MAIL_USE_SSL=True,
-        MAIL_USERNAME=os.getenv('CONFIG_EMAIL'),
-        MAIL_PASSWORD=os.getenv('CONFIG_EMAIL_PASSWORD')
-    )
-    mail.init_app(app)
 
     db.init_app(app)
+    response_encoder.init_app(app)
+    password_hasher.init_app(app)
+    mail_queue.init_app(app)
+    business_search.init_app(app)
+    revocation_cache.init_app(app)
 
     jwt = JWTManager(app)
 
@@ -40,11 +40,24 @@ def create_app(config_object):
         })
         return response
 
+    @app.route('/api/v2/metrics/db-pool')
+    @jwt_required
+    def database_pool_metrics():
+        response = jsonify({
+            'pool_stats': db.pool_stats(),
+            'status_code': 200
+        })
+        return response
+
+    @jwt.user_claims_loader
+    def add_token_version(identity):
+        if revocation_cache.epoch_mode:
+            return {'ver': revocation_cache.user_epoch(identity)}
+        return {}
+
     @jwt.token_in_blacklist_loader
     def check_if_token_in_blacklist(decrypted_token):
-        jti = decrypted_token['jti']
-
-        return RevokedToken.is_jti_blacklisted(jti)
+        return revocation_cache.is_token_revoked(decrypted_token)
 
     app.register_blueprint(user_api, url_prefix='/api/v2/auth')
     app.register_blueprint(business_api, url_prefix='/api/v2')
@@ -5,16 +5,31 @@ view a single business, view all businesses.
 
 """
 
+import io
 import re
+import zlib
 
-from flask import Blueprint, request, make_response, jsonify
+from flask import (
+    Blueprint, Response, current_app, request, make_response,
+    stream_with_context)
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from flask_restful import Resource, Api
+from sqlalchemy import func, or_
+from sqlalchemy.exc import IntegrityError
 
+from app.database import read_from_replica
+from app.encoding import jsonify, output_json, response_encoder
 from app.models import Business
 from app.models import User
 from app.models import db
-from app.utils import business_name_registered, get_paginated_list
+from app.importer import FORMATS, BusinessImporter, read_records
+from app.search import business_search
+from app.utils import (
+    business_name_registered, business_to_dict, get_page_size,
+    get_keyset_page, get_paginated_query, get_paginated_page, escape_like,
+    not_modified)
+
+UPDATE_FIELDS = ('name', 'category', 'location', 'summary')
 
 
 class Businesses(Resource):
@@ -97,6 +112,7 @@ class Businesses(Resource):
                                     business_location,
                                     business_summary, created_by)
                 business_to_save.save()
+                business_search.add_business(business_to_save)
                 business = Business.query.filter_by(name=business_name).first()
                 user = User.query.filter_by(id=business.created_by).first()
                 business_object = {
@@ -128,12 +144,35 @@ class Businesses(Resource):
             return response
 
     @jwt_required
+    @read_from_replica
     def get(self):
         """View all registered businesses.
+
+        Passing `after_id` or `limit` returns one page of businesses ordered
+        by id together with a cursor for the next page. Passing `ids`
+        returns the listed businesses in the requested order.
         ---
         tags:
             -   businesses
         parameters:
+            -   in: query
+                name: ids
+                description: comma separated business ids to fetch
+                required: false
+                schema:
+                    type: string
+            -   in: query
+                name: after_id
+                description: id of the last business of the previous page
+                required: false
+                schema:
+                    type: integer
+            -   in: query
+                name: limit
+                description: maximum number of businesses in the page
+                required: false
+                schema:
+                    type: integer
             -   in: header
                 name: authorization
                 description: JSON Web Token
@@ -164,6 +203,12 @@ class Businesses(Resource):
                         created_by:
                             type: integer
                             description: describes the id of the business owner
+                        user_name:
+                            type: string
+                            description: username of the business owner
+                        next_cursor:
+                            type: integer
+                            description: after_id of the next page
             500:
                 description: Internal server error
                 schema:
@@ -179,24 +224,39 @@ class Businesses(Resource):
 
         """
 
+        business_ids = request.args.get('ids')
+        if business_ids is not None:
+            return BusinessBatch.fetch(business_ids.split(','))
+
+        after_id = request.args.get('after_id', type=int)
+        limit = request.args.get('limit', type=int)
+        businesses = db.session.query(Business, User.username).outerjoin(
+            User, Business.created_by == User.id)
+
         try:
-            businesses = Business.query.all()
-            business_result = []
+            if after_id is None and limit is None:
+                business_result = [
+                    business_to_dict(business, user_name)
+                    for business, user_name in
+                    businesses.order_by(Business.id).all()]
 
-            for business in businesses:
-                user = User.query.filter_by(id=business.created_by).first()
-                _object = {
-                    'id': business.id,
-                    'name': business.name,
-                    'category': business.category,
-                    'location': business.location,
-                    'summary': business.summary,
-                    'created_by': business.created_by,
-                    'user_name': user.username
-                }
-                business_result.append(_object)
+                response = jsonify(business_list=business_result)
+                response.status_code = 200
+                return response
 
-            response = jsonify(business_list=business_result)
+            page_size = get_page_size(limit)
+            rows, next_cursor = get_keyset_page(
+                businesses, Business.id, after_id, page_size)
+            response = jsonify({
+                'business_list': [
+                    business_to_dict(business, user_name)
+                    for business, user_name in rows],
+                'limit': page_size,
+                'next_cursor': next_cursor,
+                'next': '' if next_cursor is None else
+                '/api/v2/businesses?after_id=%d&limit=%d' % (
+                    next_cursor, page_size)
+            })
             response.status_code = 200
             return response
         except Exception as e:
@@ -207,11 +267,277 @@ class Businesses(Resource):
             return response
 
 
+class BusinessBatch(Resource):
+
+    """Illustrate API endpoint to view several businesses at once."""
+
+    @jwt_required
+    def post(self):
+        """View the businesses matching a list of ids.
+        ---
+        tags:
+            -   businesses
+        parameters:
+            -   in: header
+                name: authorization
+                description: JSON Web Token
+                type: string
+                required: true
+                x-authentication: Bearer
+            -   in: body
+                name: body
+                schema:
+                    required:
+                        - ids
+                    properties:
+                        ids:
+                            type: array
+                            items:
+                                type: integer
+                            description: business ids to fetch
+        responses:
+            200:
+                description: Businesses in the requested order, ids that
+                    are not registered carry a 404 status_code
+                schema:
+                    name: business_list
+            406:
+                description: Missing, invalid or too many ids
+                schema:
+                    properties:
+                        response_message:
+                            type: string
+        """
+        req_data = request.get_json(force=True) or {}
+        business_ids = req_data.get('ids')
+        if not isinstance(business_ids, list):
+            business_ids = []
+        return self.fetch(business_ids)
+
+    @staticmethod
+    def fetch(business_ids):
+        """Fetch businesses by id with one query.
+
+        Args:
+            business_ids(list): requested ids, as integers or strings.
+
+        Returns:
+            A response listing the businesses in the requested order.
+        """
+        try:
+            business_ids = [
+                int(business_id) for business_id in business_ids
+                if str(business_id).strip()]
+        except (TypeError, ValueError):
+            response = jsonify({
+                'response_message': 'Business ids must be integers!',
+                'status_code': 406
+            })
+            return response
+        if not business_ids:
+            response = jsonify({
+                'response_message': 'Business ids are required!',
+                'status_code': 406
+            })
+            return response
+        max_ids = current_app.config['BUSINESS_BATCH_MAX_IDS']
+        if len(business_ids) > max_ids:
+            response = jsonify({
+                'response_message':
+                    'At most {} business ids are allowed!'.format(max_ids),
+                'status_code': 406
+            })
+            return response
+
+        try:
+            rows = db.session.query(Business, User.username).outerjoin(
+                User, Business.created_by == User.id).filter(
+                    Business.id.in_(set(business_ids))).all()
+            found = {
+                business.id: business_to_dict(business, user_name)
+                for business, user_name in rows}
+            response = jsonify({
+                'business_list': [
+                    found.get(business_id, {
+                        'id': business_id,
+                        'response_message': 'Business not found!',
+                        'status_code': 404})
+                    for business_id in business_ids],
+                'status_code': 200
+            })
+            response.status_code = 200
+            return response
+        except Exception as e:
+            response = jsonify({
+                'response_message': str(e),
+                'status_code': 500
+            })
+            return response
+
+
+class ImportBusinesses(Resource):
+
+    """Illustrate API endpoint to register businesses in bulk."""
+
+    @jwt_required
+    def post(self):
+        """Register businesses from an NDJSON or CSV upload.
+        ---
+        tags:
+            -   businesses
+        consumes:
+            -   application/x-ndjson
+            -   text/csv
+        parameters:
+            -   in: header
+                name: authorization
+                description: JSON Web Token
+                type: string
+                required: true
+                x-authentication: Bearer
+            -   in: query
+                name: format
+                description: ndjson or csv, defaults to the content type
+                required: false
+                schema:
+                    type: string
+            -   in: body
+                name: body
+                description: one business per line, with name, category,
+                    location and summary
+                schema:
+                    type: string
+        responses:
+            201:
+                description: Result of every row of the upload
+                schema:
+                    properties:
+                        created:
+                            type: integer
+                        skipped:
+                            type: integer
+                        results:
+                            type: array
+            406:
+                description: Unsupported upload format
+                schema:
+                    properties:
+                        response_message:
+                            type: string
+        """
+        data_format = request.args.get('format')
+        if data_format is None:
+            data_format = 'csv' if request.mimetype == 'text/csv' \
+                else 'ndjson'
+        if data_format not in FORMATS:
+            response = jsonify({
+                'response_message': 'Upload format must be ndjson or csv!',
+                'status_code': 406
+            })
+            return response
+
+        stream = io.TextIOWrapper(
+            request.stream, encoding='utf-8', newline='')
+        importer = BusinessImporter(
+            get_jwt_identity(),
+            current_app.config['BUSINESS_IMPORT_CHUNK_SIZE'],
+            on_created=business_search.add_business)
+        try:
+            report = importer.run(read_records(stream, data_format))
+        except Exception as e:
+            db.session.rollback()
+            response = jsonify({
+                'response_message': str(e),
+                'status_code': 500
+            })
+            return response
+        report['status_code'] = 201
+        response = jsonify(report)
+        response.status_code = 201
+        return response
+
+
+class ExportBusinesses(Resource):
+
+    """Illustrate API endpoint to download the business directory."""
+
+    @jwt_required
+    def get(self):
+        """Stream every registered business as newline delimited JSON.
+
+        Businesses are written in id order, a client that lost the
+        connection resumes by passing the id of the last line it received
+        as `after_id`.
+        ---
+        tags:
+            -   businesses
+        produces:
+            -   application/x-ndjson
+        parameters:
+            -   in: query
+                name: after_id
+                description: id of the last business already received
+                required: false
+                schema:
+                    type: integer
+            -   in: header
+                name: Accept-Encoding
+                description: gzip to compress the stream
+                type: string
+                required: false
+            -   in: header
+                name: authorization
+                description: JSON Web Token
+                type: string
+                required: true
+                x-authentication: Bearer
+        responses:
+            200:
+                description: One business dictionary per line, with the
+                    username of its owner
+        """
+        after_id = request.args.get('after_id', 0, type=int)
+        batch_size = current_app.config['EXPORT_BATCH_SIZE']
+        compress = request.accept_encodings['gzip'] > 0
+        rows = db.session.query(
+            Business.id, Business.name, Business.category, Business.location,
+            Business.summary, Business.created_by, User.username).outerjoin(
+                User, Business.created_by == User.id).filter(
+                    Business.id > after_id).order_by(
+                        Business.id).execution_options(
+                            stream_results=True).yield_per(batch_size)
+
+        def generate():
+            compressor = zlib.compressobj(
+                6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+            lines = []
+            for row in rows:
+                lines.append(response_encoder.dumps(
+                    business_to_dict(row, row.username)))
+                if len(lines) == batch_size:
+                    chunk = b'\n'.join(lines) + b'\n'
+                    lines = []
+                    yield compressor.compress(chunk) if compress else chunk
+            chunk = b'\n'.join(lines) + b'\n' if lines else b''
+            if compress:
+                yield compressor.compress(chunk) + compressor.flush()
+            elif chunk:
+                yield chunk
+
+        response = Response(stream_with_context(generate()),
+                            mimetype='application/x-ndjson')
+        response.headers['Vary'] = 'Accept-Encoding'
+        if compress:
+            response.headers['Content-Encoding'] = 'gzip'
+        return response
+
+
 class OneBusiness(Resource):
 
     """Illustrate API endpoints to manipulate single business."""
 
     @jwt_required
+    @read_from_replica
     def get(self, business_id):
         """view a registered business by id.
         ---
@@ -230,6 +556,11 @@ class OneBusiness(Resource):
                 type: string
                 required: true
                 x-authentication: Bearer
+            -   in: header
+                name: If-None-Match
+                description: ETag of a previously fetched copy
+                type: string
+                required: false
         responses:
             200:
                 description: A dictionary of business data
@@ -253,6 +584,8 @@ class OneBusiness(Resource):
                         created_by:
                             type: integer
                             description: describes the id of the business owner
+            304:
+                description: The copy matching If-None-Match is current
             404:
                 description: Business is not registered
                 schema:
@@ -267,6 +600,16 @@ class OneBusiness(Resource):
                             type: string
         """
 
+        if request.if_none_match:
+            # Revalidation only needs the version column.
+            version = db.session.query(Business.version).filter_by(
+                id=business_id).scalar()
+            if version is not None:
+                response = not_modified(
+                    'business-%d-%d' % (business_id, version))
+                if response is not None:
+                    return response
+
         business = Business.query.filter_by(id=business_id).first()
         if business:
             try:
@@ -280,6 +623,8 @@ class OneBusiness(Resource):
                 })
 
                 business_object.status_code = 200
+                business_object.set_etag(
+                    'business-%d-%d' % (business.id, business.version))
                 return business_object
             except Exception as e:
                 response = jsonify({
@@ -353,12 +698,24 @@ class OneBusiness(Resource):
                         created_by:
                             type: integer
                             description: describes the id of the business owner
+            401:
+                description: Permission required
+                schema:
+                    properties:
+                        response_message:
+                            type: string
             404:
                 description: Business is not registered
                 schema:
                     properties:
                         response_message:
                             type: string
+            406:
+                description: Null business fields
+                schema:
+                    properties:
+                        response_message:
+                            type: string
             500:
                 description: Internal server error
                 schema:
@@ -367,52 +724,164 @@ class OneBusiness(Resource):
                             type: string
         """
 
-        req_data = request.get_json(force=True)
-        business_name = req_data.get('name')
-        business_category = req_data.get('category')
-        business_location = req_data.get('location')
-        business_summary = req_data.get('summary')
+        req_data = request.get_json(force=True) or {}
+        new_values = {field: req_data.get(field) for field in UPDATE_FIELDS}
+        if not all(new_values.values()):
+            response = jsonify({
+                'response_message': 'Business name, category, location '
+                                    'and summary are required!',
+                'status_code': 406
+            })
+            return response
+        return self.update_business(business_id, new_values)
 
-        business_is_registered = Business.query.filter_by(
-            id=business_id).first()
-        if business_is_registered:
-            try:
-                Business.query.filter_by(id=business_id).update(dict(
-                    name=business_name,
-                    category=business_category,
-                    location=business_location,
-                    summary=business_summary
-                ))
-                db.session.commit()
-
-                new_business = Business.query.filter_by(id=business_id).first()
-                user = User.query.filter_by(id=new_business.created_by).first()
-                business_object = jsonify({
-                    'message': 'Business successfuly updated!',
-                    'status_code': 200,
-                    'data': {
-                        'id': new_business.id,
-                        'name': new_business.name,
-                        'category': new_business.category,
-                        'location': new_business.location,
-                        'summary': new_business.summary,
-                        'created_by': new_business.created_by,
-                        'user_name': user.username
-                    }
-                })
-                return business_object
-            except Exception as e:
+    @jwt_required
+    def patch(self, business_id):
+        """Update some fields of a registered business.
+
+        Fields missing from the body keep their current value.
+        ---
+        tags:
+            -   businesses
+        parameters:
+            -   in: path
+                name: business_id
+                required: true
+                schema:
+                    type: integer
+            -   in: header
+                name: authorization
+                description: JSON Web Token
+                type: string
+                required: true
+                x-authentication: Bearer
+            -   in: body
+                name: new data
+                description: business fields to change
+                schema:
+                    properties:
+                        name:
+                            type: string
+                            description: Unique business name
+                        category:
+                            type: string
+                            description: businesses with the same features
+                        location:
+                            type: string
+                            description: Business physical location
+                        summary:
+                            type: string
+                            description: Describes the business
+        responses:
+            200:
+                description: A dictionary of the updated business data
+            401:
+                description: Permission required
+                schema:
+                    properties:
+                        response_message:
+                            type: string
+            404:
+                description: Business is not registered
+                schema:
+                    properties:
+                        response_message:
+                            type: string
+            406:
+                description: No field to update or a null field
+                schema:
+                    properties:
+                        response_message:
+                            type: string
+        """
+        req_data = request.get_json(force=True) or {}
+        new_values = {field: req_data[field] for field in UPDATE_FIELDS
+                      if field in req_data}
+        if not new_values or not all(new_values.values()):
+            response = jsonify({
+                'response_message': 'Provide non empty business name, '
+                                    'category, location or summary!',
+                'status_code': 406
+            })
+            return response
+        return self.update_business(business_id, new_values)
+
+    @staticmethod
+    def update_business(business_id, new_values):
+        """Change business columns of the user's own business and bump
+        the business version.
+
+        On Postgres the new row and the owner's username come back from a
+        single UPDATE ... RETURNING, other databases read them back with
+        one joined SELECT.
+
+        Args:
+            business_id(int): id of the business to update.
+            new_values(dict): column name to new value.
+
+        Returns:
+            A response with the updated business.
+        """
+        created_by = get_jwt_identity()
+        business = Business.__table__
+        statement = business.update().where(
+            (business.c.id == business_id) &
+            (business.c.created_by == created_by)).values(
+                version=business.c.version + 1, **new_values)
+        columns = [business.c.id, business.c.name, business.c.category,
+                   business.c.location, business.c.summary,
+                   business.c.created_by]
+        try:
+            if db.engine.dialect.name == 'postgresql':
+                user_name = db.select([User.username]).where(
+                    User.id == business.c.created_by).correlate(
+                        business).as_scalar().label('user_name')
+                updated = db.session.execute(
+                    statement.returning(*columns + [user_name])).first()
+            else:
+                updated = None
+                if db.session.execute(statement).rowcount:
+                    updated = db.session.query(
+                        *columns + [User.username.label('user_name')]
+                    ).outerjoin(User, business.c.created_by == User.id).filter(
+                        business.c.id == business_id).first()
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            response = jsonify({
+                'response_message': 'Business name already registered!',
+                'status_code': 406
+            })
+            return response
+        except Exception as e:
+            db.session.rollback()
+            response = jsonify({
+                'response_message': str(e),
+                'status_code': 500
+            })
+            return response
+
+        if updated is None:
+            if db.session.query(Business.id).filter_by(
+                    id=business_id).scalar() is None:
                 response = jsonify({
-                    'response_message': str(e),
-                    'status_code': 500
+                    'response_message': 'Business id is not registered!',
+                    'status_code': 404
                 })
                 return response
-        else:
             response = jsonify({
-                'response_message': 'Business id is not registered!',
-                'status_code': 404
+                'response_message':
+                    'Permission required to update this business!',
+                'status_code': 401
             })
             return response
+        business_search.add_business(updated)
+        response = jsonify({
+            'message': 'Business successfuly updated!',
+            'status_code': 200,
+            'data': business_to_dict(updated, updated.user_name)
+        })
+        return response
 
     @jwt_required
     def delete(self, business_id):
@@ -460,46 +929,56 @@ class OneBusiness(Resource):
         """
 
         created_by = get_jwt_identity()
-        business = Business.query.filter_by(id=business_id).first()
-        if business is None:
+        business = Business.__table__
+        statement = business.delete().where(
+            (business.c.id == business_id) &
+            (business.c.created_by == created_by))
+        columns = [business.c.id, business.c.name, business.c.category,
+                   business.c.location, business.c.summary,
+                   business.c.created_by]
+        try:
+            # Reviews go with the business through ON DELETE CASCADE.
+            if db.engine.dialect.name == 'postgresql':
+                deleted = db.session.execute(
+                    statement.returning(*columns)).first()
+            else:
+                deleted = db.session.query(*columns).filter(
+                    business.c.id == business_id,
+                    business.c.created_by == created_by).first()
+                if deleted is not None:
+                    db.session.execute(statement)
+            if deleted is not None:
+                User.count_businesses(created_by, -1)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
             response = jsonify({
-                'response_message': 'Business id is not registered!',
-                'status_code': 404
+                'response_message': str(e),
+                'status_code': 500
             })
             return response
 
-        if business.created_by == created_by:
-            try:
-                business = Business.query.filter_by(id=business_id).first()
-
-                db.session.delete(business)
-                db.session.commit()
-                response = jsonify({
-                    'message': 'Business successfuly deleted!',
-                    'status_code': 204,
-                    'data': {
-                        'id': business.id,
-                        'name': business.name,
-                        'category': business.category,
-                        'location': business.location,
-                        'summary': business.summary,
-                        'created_by': business.created_by
-                    }
-                })
-                return response
-            except Exception as e:
-                response = jsonify({
-                    'response_message': str(e),
-                    'status_code': 500
-                })
-                return response
-        else:
+        if deleted is not None:
+            business_search.remove_business(business_id)
             response = jsonify({
-                'response_message':
-                    'Permission required to delete this business!',
-                'status_code': 401
+                'message': 'Business successfuly deleted!',
+                'status_code': 204,
+                'data': business_to_dict(deleted)
             })
             return response
+        if db.session.query(Business.id).filter_by(
+                id=business_id).scalar() is None:
+            response = jsonify({
+                'response_message': 'Business id is not registered!',
+                'status_code': 404
+            })
+            return response
+        response = jsonify({
+            'response_message':
+                'Permission required to delete this business!',
+            'status_code': 401
+        })
+        return response
 
 
 class UserBusiness(Resource):
@@ -508,7 +987,10 @@ class UserBusiness(Resource):
 
     @jwt_required
     def get(self, user_id):
-        """view a registered business by user id.
+        """View the businesses registered by a user.
+
+        Businesses are returned a page at a time ordered by id together
+        with a cursor for the next page.
         ---
         tags:
             -   businesses
@@ -519,6 +1001,24 @@ class UserBusiness(Resource):
                 description: a unique user id
                 schema:
                     type: integer
+            -   in: query
+                name: after_id
+                description: id of the last business of the previous page
+                required: false
+                schema:
+                    type: integer
+            -   in: query
+                name: limit
+                description: maximum number of businesses in the page
+                required: false
+                schema:
+                    type: integer
+            -   in: query
+                name: total
+                description: set to true to include the number of businesses
+                required: false
+                schema:
+                    type: boolean
             -   in: header
                 name: authorization
                 description: JSON Web Token
@@ -527,8 +1027,9 @@ class UserBusiness(Resource):
                 x-authentication: Bearer
         responses:
             200:
-                description: A dictionary of business data
+                description: A list of dictionaries of businesses
                 schema:
+                    name: business_list
                     properties:
                         id:
                             type: integer
@@ -546,8 +1047,23 @@ class UserBusiness(Resource):
                             type: string
                             description: business description
                         created_by:
+                            type: integer
+                            description: describes the id of the business owner
+                        user_name:
                             type: string
                             description: username of the business owner
+                        next_cursor:
+                            type: integer
+                            description: after_id of the next page
+                        total:
+                            type: integer
+                            description: number of businesses of the user
+            204:
+                description: User has not registered a business
+                schema:
+                    properties:
+                        response_message:
+                            type: string
             404:
                 description: User is not registered
                 schema:
@@ -561,38 +1077,59 @@ class UserBusiness(Resource):
                         response_message:
                             type: string
         """
-        user = User.query.filter_by(id=user_id).first()
-        if user:
-            business = Business.query.filter_by(created_by=user_id).first()
-            if business:
-                try:
-                    business_object = jsonify({
-                        'id': business.id,
-                        'name': business.name,
-                        'category': business.category,
-                        'location': business.location,
-                        'summary': business.summary,
-                        'created_by': user.username
-                    })
+        after_id = request.args.get('after_id', type=int)
+        page_size = get_page_size(request.args.get('limit', type=int))
+        with_total = request.args.get('total', '').lower() == 'true'
+        # The owner's username and business counter are joined into the
+        # page query, the user is only looked up alone for an empty page.
+        businesses = db.session.query(
+            Business, User.username, User.business_count).join(
+                User, Business.created_by == User.id).filter(
+                    Business.created_by == user_id)
 
-                    business_object.status_code = 200
-                    return business_object
-                except Exception as e:
+        try:
+            rows, next_cursor = get_keyset_page(
+                businesses, Business.id, after_id, page_size)
+            if rows:
+                user_name, total = rows[0][1:]
+            else:
+                user = db.session.query(
+                    User.username, User.business_count).filter_by(
+                        id=user_id).first()
+                if user is None:
                     response = jsonify({
-                        'response_message': str(e),
-                        'status_code': 500
+                        'response_message': 'User is not registered!',
+                        'status_code': 404
                     })
                     return response
-            else:
-                response = jsonify({
-                    'response_message': 'You have not registered a business!',
-                    'status_code': 204
-                })
+                if after_id is None:
+                    response = jsonify({
+                        'response_message':
+                            'You have not registered a business!',
+                        'status_code': 204
+                    })
+                    return response
+                user_name, total = user
+
+            result = {
+                'business_list': [
+                    business_to_dict(business, user_name)
+                    for business, _, _ in rows],
+                'limit': page_size,
+                'next_cursor': next_cursor,
+                'next': '' if next_cursor is None else
+                '/api/v2/businesses/user/%d?after_id=%d&limit=%d' % (
+                    user_id, next_cursor, page_size)
+            }
+            if with_total:
+                result['total'] = total
+            response = jsonify(result)
+            response.status_code = 200
             return response
-        else:
+        except Exception as e:
             response = jsonify({
-                'response_message': 'User is not registered!',
-                'status_code': 404
+                'response_message': str(e),
+                'status_code': 500
             })
             return response
 
@@ -602,6 +1139,7 @@ class SearchBusiness(Resource):
     """Illustrate API endpoints to search businesses."""
 
     @jwt_required
+    @read_from_replica
     def get(self):
         """Search a registered business.
         ---
@@ -626,6 +1164,24 @@ class SearchBusiness(Resource):
                 required: true
                 schema:
                     type: integer
+            -   in: query
+                name: mode
+                description: prefix (default), ranked or fuzzy search
+                required: false
+                schema:
+                    type: string
+            -   in: query
+                name: operator
+                description: ranked search requires all (and) or any (or) term
+                required: false
+                schema:
+                    type: string
+            -   in: query
+                name: threshold
+                description: minimum name/category similarity of fuzzy mode
+                required: false
+                schema:
+                    type: number
             -   in: header
                 name: authorization
                 description: JSON Web Token
@@ -670,43 +1226,53 @@ class SearchBusiness(Resource):
                             type: string
         """
 
-        user_request = request.args.get('q').lower()
-        result_start = int(request.args.get('start'))
-        result_limit = int(request.args.get('limit'))
-        found_businesses = []
-        all_businesses = Business.query.all()
-        for row in all_businesses:
-            if row.name.startswith(user_request) or \
-                row.category.startswith(user_request) or \
-                    row.location.startswith(user_request):
-                        found_businesses.append(row)
-        if found_businesses:
+        result_start = max(request.args.get('start', 1, type=int), 1)
+        result_limit = get_page_size(request.args.get('limit', type=int))
+        mode = request.args.get('mode')
+        if mode in ('ranked', 'fuzzy'):
             try:
-                business_list = []
-
-                for business in found_businesses:
-                    _object = {
-                        'id': business.id,
-                        'name': business.name,
-                        'category': business.category,
-                        'location': business.location,
-                        'summary': business.summary,
-                        'created_by': business.created_by
-                    }
-                    business_list.append(_object)
-
-                pagination_res = get_paginated_list(business_list,
-                                                    '/api/v1/business/search',
-                                                    result_start, result_limit)
-                response = jsonify(pagination_res)
-                response.status_code = 200
-                return response
+                if mode == 'ranked':
+                    operator = 'or' if request.args.get('operator') == 'or' \
+                        else 'and'
+                    matches = business_search.search(
+                        request.args.get('q', ''), operator,
+                        limit=result_start + result_limit)
+                else:
+                    threshold = request.args.get('threshold', type=float)
+                    if threshold is not None:
+                        threshold = min(max(threshold, 0.05), 1.0)
+                    matches = business_search.fuzzy_search(
+                        request.args.get('q', ''), threshold,
+                        limit=result_start + result_limit)
             except Exception as e:
                 response = jsonify({
                     'response_message': str(e),
                     'status_code': 500
                 })
                 return response
+            return self.indexed_search(matches, result_start, result_limit)
+
+        user_request = escape_like(request.args.get('q', '').lower())
+        pattern = user_request + '%'
+        found_businesses = db.session.query(Business, User.username).outerjoin(
+            User, Business.created_by == User.id).filter(or_(
+                func.lower(Business.name).like(pattern, escape='\\'),
+                func.lower(Business.category).like(pattern, escape='\\'),
+                func.lower(Business.location).like(pattern, escape='\\')))
+        try:
+            pagination_res = get_paginated_query(
+                found_businesses.order_by(Business.id),
+                '/api/v2/businesses/search', result_start, result_limit)
+        except Exception as e:
+            response = jsonify({
+                'response_message': str(e),
+                'status_code': 500
+            })
+            return response
+        if pagination_res['business_list']:
+            response = jsonify(pagination_res)
+            response.status_code = 200
+            return response
         else:
             response = jsonify({
                 'response_message': 'Business not found!',
@@ -714,12 +1280,141 @@ class SearchBusiness(Resource):
             })
             return response
 
+    def indexed_search(self, results, start, limit):
+        """Render one page of search index results.
+
+        Args:
+            results(list): (business id, score) tuples, best match first.
+            start(int): position of the first result, starting from 1
+            limit(int): maximum number of results in the page
+
+        Returns:
+            A page of businesses in the order of the results.
+        """
+        try:
+            page = results[start - 1:start - 1 + limit]
+            rows = db.session.query(Business, User.username).outerjoin(
+                User, Business.created_by == User.id).filter(
+                    Business.id.in_([business_id for business_id, _ in page])
+                ).all() if page else []
+            found = {business.id: (business, user_name)
+                     for business, user_name in rows}
+
+            business_list = []
+            for business_id, score in page:
+                if business_id in found:
+                    _object = business_to_dict(*found[business_id])
+                    _object['score'] = round(score, 4)
+                    business_list.append(_object)
+        except Exception as e:
+            response = jsonify({
+                'response_message': str(e),
+                'status_code': 500
+            })
+            return response
+        if business_list:
+            response = jsonify(get_paginated_page(
+                business_list, '/api/v2/businesses/search', start, limit,
+                len(results) >= start + limit))
+            response.status_code = 200
+            return response
+        else:
+            response = jsonify({
+                'response_message': 'Business not found!',
+                'status_code': 404
+            })
+            return response
+
+
+class SuggestBusiness(Resource):
+
+    """Illustrate API endpoint to autocomplete business attributes."""
+
+    @jwt_required
+    def get(self):
+        """Suggest business names, categories and locations.
+        ---
+        tags:
+            -   businesses
+        parameters:
+            -   in: query
+                name: q
+                description: text typed so far
+                required: true
+                schema:
+                    type: string
+            -   in: query
+                name: limit
+                description: maximum number of suggestions per field
+                required: false
+                schema:
+                    type: integer
+            -   in: header
+                name: authorization
+                description: JSON Web Token
+                type: string
+                required: true
+                x-authentication: Bearer
+        responses:
+            200:
+                description: Most used completions of each field
+                schema:
+                    properties:
+                        name:
+                            type: array
+                        category:
+                            type: array
+                        location:
+                            type: array
+            406:
+                description: Null required parameters
+                schema:
+                    properties:
+                        response_message:
+                            type: string
+        """
+        prefix = request.args.get('q', '').strip()
+        if not prefix:
+            response = jsonify({
+                'response_message': 'Query parameter q is required!',
+                'status_code': 406
+            })
+            return response
+
+        try:
+            completions = business_search.suggest(
+                prefix, get_page_size(request.args.get('limit', type=int)))
+        except Exception as e:
+            response = jsonify({
+                'response_message': str(e),
+                'status_code': 500
+            })
+            return response
+        response = jsonify({
+            'suggestions': {
+                field: [{'text': text, 'count': count}
+                        for text, count in matches]
+                for field, matches in completions.items()},
+            'status_code': 200
+        })
+        response.status_code = 200
+        return response
+
 
 business_api = Blueprint('business.views', __name__)
 api = Api(business_api)
+api.representation('application/json')(output_json)
 api.add_resource(Businesses, '/businesses', endpoint='businesses')
+api.add_resource(
+    BusinessBatch, '/businesses/batch', endpoint='business_batch')
+api.add_resource(
+    ImportBusinesses, '/businesses/import', endpoint='import_businesses')
+api.add_resource(
+    ExportBusinesses, '/businesses/export', endpoint='export_businesses')
 api.add_resource(OneBusiness,
                  '/businesses/<int:business_id>', endpoint='business')
 api.add_resource(UserBusiness,
                  '/businesses/user/<int:user_id>', endpoint='user_business')
 api.add_resource(SearchBusiness, '/businesses/search', endpoint='search')
+api.add_resource(
+    SuggestBusiness, '/businesses/suggest', endpoint='suggest')
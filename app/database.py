@@ -0,0 +1,407 @@
+"""Configure the database engine and measure its connection pool.
+
+Flask-SQLAlchemy only forwards the pool size, overflow, timeout and
+recycle settings to the engine. The SQLAlchemy subclass here also turns on
+SQLALCHEMY_POOL_PRE_PING, so a connection dropped by a database restart or
+failover is replaced on checkout instead of failing the request, and on
+Postgres sets DATABASE_STATEMENT_TIMEOUT and
+DATABASE_IDLE_IN_TRANSACTION_TIMEOUT, in milliseconds, on every new
+connection.
+
+Pooled engines use InstrumentedQueuePool, which records how long requests
+wait for a connection and how close the pool gets to its capacity. The
+numbers are served by GET /api/v2/metrics/db-pool and are meant to size
+SQLALCHEMY_POOL_SIZE and SQLALCHEMY_MAX_OVERFLOW against the number of
+workers, every worker process has a pool of its own.
+
+Resource methods decorated with `read_from_replica` read from the engines
+listed in SQLALCHEMY_REPLICA_BINDS, keys of SQLALCHEMY_BINDS, taken in
+turn. A replica is checked before it is used at most every
+REPLICA_CHECK_SECONDS, one that cannot be reached is ejected for
+REPLICA_EJECT_SECONDS, and reads go to the primary when no replica is
+left. Checks run on the request path, so connecting to a Postgres
+replica gives up after REPLICA_CONNECT_TIMEOUT seconds.
+
+Reads of a user that wrote within REPLICA_READ_YOUR_WRITES_SECONDS stay
+on the primary, so that the user sees their own writes despite the
+replication lag. A successful write of an authenticated user is
+remembered by the worker that served it, and answered with a signed
+X-Last-Write header. Clients send the header back with their reads so
+the other workers keep them on the primary too. Neither check touches
+the database.
+
+"""
+
+import functools
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, request
+from flask_jwt_extended import get_jwt_identity
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from flask_sqlalchemy import SQLAlchemy as BaseSQLAlchemy
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event, orm
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import QueuePool
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+LAST_WRITE_HEADER = 'X-Last-Write'
+
+
+class PoolMetrics(object):
+
+    """Count connection checkouts of a pool and the time spent waiting."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {
+            'checkouts': 0,
+            'timeouts': 0,
+            'wait_seconds': 0.0,
+            'max_wait_seconds': 0.0,
+            'peak_checked_out': 0
+        }
+
+    def record(self, seconds, checked_out=None):
+        """Record one checkout attempt.
+
+        Args:
+            seconds(float): time spent waiting for the connection.
+            checked_out(int): connections in use after the checkout, None
+                when the checkout timed out.
+        """
+        with self._lock:
+            if checked_out is None:
+                self.counters['timeouts'] += 1
+            else:
+                self.counters['checkouts'] += 1
+                self.counters['peak_checked_out'] = max(
+                    self.counters['peak_checked_out'], checked_out)
+            self.counters['wait_seconds'] += seconds
+            self.counters['max_wait_seconds'] = max(
+                self.counters['max_wait_seconds'], seconds)
+
+    def stats(self, pool):
+        """Report checkout latency and saturation of a pool.
+
+        Returns:
+            A dictionary of the counters with the average and maximum
+            checkout latency in milliseconds and the share of the pool
+            capacity in use.
+        """
+        with self._lock:
+            stats = dict(self.counters)
+        attempts = stats['checkouts'] + stats['timeouts']
+        stats['avg_checkout_ms'] = round(
+            1000 * stats.pop('wait_seconds') / attempts, 3) \
+            if attempts else 0.0
+        stats['max_checkout_ms'] = round(
+            1000 * stats.pop('max_wait_seconds'), 3)
+
+        checked_out = pool.checkedout()
+        # A negative overflow lets the pool grow without bound.
+        capacity = pool.size() + pool._max_overflow \
+            if pool._max_overflow >= 0 else None
+        stats.update(
+            pool_size=pool.size(),
+            max_overflow=pool._max_overflow,
+            checked_out=checked_out,
+            overflow=max(pool.overflow(), 0),
+            capacity=capacity,
+            saturation=round(checked_out / capacity, 3)
+            if capacity else None)
+        return stats
+
+
+class InstrumentedQueuePool(QueuePool):
+
+    """QueuePool timing every checkout into PoolMetrics."""
+
+    def __init__(self, creator, **kwargs):
+        super(InstrumentedQueuePool, self).__init__(creator, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super(InstrumentedQueuePool, self)._do_get()
+        except PoolTimeout:
+            self.metrics.record(time.perf_counter() - started)
+            raise
+        self.metrics.record(time.perf_counter() - started, self.checkedout())
+        return connection
+
+    def recreate(self):
+        # Disposing the engine replaces the pool, keep counting into the
+        # same metrics.
+        pool = super(InstrumentedQueuePool, self).recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+class ReplicaRouter(object):
+
+    """Pick read replicas in turn, skipping the ones that are down."""
+
+    def __init__(self, db, app):
+        self.db = db
+        self.app = app
+        self.keys = list(app.config['SQLALCHEMY_REPLICA_BINDS'])
+        self.eject_seconds = app.config['REPLICA_EJECT_SECONDS']
+        self.check_seconds = app.config['REPLICA_CHECK_SECONDS']
+        self._lock = threading.Lock()
+        self._next = 0
+        self._engines = {}
+        self.ejected_until = dict.fromkeys(self.keys, 0)
+        self.checked_at = dict.fromkeys(self.keys, 0)
+
+    def choose(self):
+        """Return the engine of the next healthy replica.
+
+        Returns:
+            An engine, None when every replica is ejected.
+        """
+        for _ in self.keys:
+            now = time.time()
+            with self._lock:
+                key = self.keys[self._next % len(self.keys)]
+                self._next += 1
+                if self.ejected_until[key] > now:
+                    continue
+                check = now - self.checked_at[key] > self.check_seconds
+            engine = self.get_engine(key)
+            if check:
+                try:
+                    engine.connect().close()
+                except DBAPIError:
+                    self.eject(key)
+                    continue
+                with self._lock:
+                    self.checked_at[key] = now
+            return engine
+        return None
+
+    def get_engine(self, key):
+        engine = self.db.get_engine(self.app, bind=key)
+        if self._engines.get(key) is not engine:
+            # A replica dropping connections while in use is ejected
+            # without waiting for its next check.
+            @event.listens_for(engine, 'handle_error')
+            def eject_disconnected(context):
+                if context.is_disconnect:
+                    self.eject(key)
+
+            self._engines[key] = engine
+        return engine
+
+    def eject(self, key):
+        """Stop reading from a replica for REPLICA_EJECT_SECONDS."""
+
+        with self._lock:
+            self.ejected_until[key] = time.time() + self.eject_seconds
+            self.checked_at[key] = 0
+
+    def stats(self):
+        """Report which replicas are in use.
+
+        Returns:
+            A dictionary of replica bind key to a boolean, False while the
+            replica is ejected.
+        """
+        now = time.time()
+        with self._lock:
+            return {key: until <= now
+                    for key, until in self.ejected_until.items()}
+
+
+class RecentWriters(object):
+
+    """Remember which users wrote through this worker a moment ago."""
+
+    def __init__(self, capacity=10000):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._written_at = OrderedDict()
+
+    def add(self, identity):
+        """Record a write of a user, forgetting the oldest beyond capacity."""
+
+        with self._lock:
+            self._written_at.pop(identity, None)
+            self._written_at[identity] = time.time()
+            while len(self._written_at) > self.capacity:
+                self._written_at.popitem(last=False)
+
+    def wrote_within(self, identity, seconds):
+        """Check whether a user wrote within the last `seconds`."""
+
+        with self._lock:
+            written_at = self._written_at.get(identity)
+        return written_at is not None and time.time() - written_at < seconds
+
+    def clear(self):
+        with self._lock:
+            self._written_at.clear()
+
+
+class RoutingSession(SignallingSession):
+
+    """Session sending the reads of read-only requests to a replica."""
+
+    def __init__(self, db, **options):
+        self.replica = None
+        super(RoutingSession, self).__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if self.replica is not None and not self._flushing:
+            return self.replica
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+class SQLAlchemy(BaseSQLAlchemy):
+
+    """Flask-SQLAlchemy with pre-ping, pool metrics, Postgres timeouts and
+    read replicas."""
+
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_POOL_PRE_PING', True)
+        app.config.setdefault('DATABASE_STATEMENT_TIMEOUT', 0)
+        app.config.setdefault('DATABASE_IDLE_IN_TRANSACTION_TIMEOUT', 0)
+        app.config.setdefault('SQLALCHEMY_REPLICA_BINDS', [])
+        app.config.setdefault('REPLICA_EJECT_SECONDS', 30)
+        app.config.setdefault('REPLICA_CHECK_SECONDS', 5)
+        app.config.setdefault('REPLICA_READ_YOUR_WRITES_SECONDS', 5)
+        app.config.setdefault('REPLICA_CONNECT_TIMEOUT', 2)
+        app.config.setdefault('REPLICA_RECENT_WRITERS', 10000)
+        super(SQLAlchemy, self).init_app(app)
+        app.extensions['recent_writers'] = RecentWriters(
+            app.config['REPLICA_RECENT_WRITERS'])
+
+        @app.after_request
+        def remember_last_write(response):
+            # Only views that verified a token have an identity, which
+            # leaves out login and registration.
+            identity = get_jwt_identity()
+            if request.method not in SAFE_METHODS and \
+                    identity is not None and \
+                    app.config['SQLALCHEMY_REPLICA_BINDS'] and \
+                    getattr(response, 'reported_status',
+                            response.status_code) < 400:
+                app.extensions['recent_writers'].add(identity)
+                response.headers[LAST_WRITE_HEADER] = \
+                    last_write_serializer().dumps(identity)
+            return response
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def get_router(self, app=None):
+        """Return the replica router of an application.
+
+        Returns:
+            A ReplicaRouter, None when no replica is configured.
+        """
+        app = self.get_app(app)
+        if not app.config['SQLALCHEMY_REPLICA_BINDS']:
+            return None
+        with self._engine_lock:
+            router = app.extensions.get('replica_router')
+            if router is None:
+                router = app.extensions['replica_router'] = ReplicaRouter(
+                    self, app)
+        return router
+
+    def apply_driver_hacks(self, app, info, options):
+        super(SQLAlchemy, self).apply_driver_hacks(app, info, options)
+        options['pool_pre_ping'] = app.config['SQLALCHEMY_POOL_PRE_PING']
+        # In memory SQLite gets a StaticPool and unsized SQLite a NullPool,
+        # every other engine gets a measured queue.
+        options.setdefault('poolclass', InstrumentedQueuePool)
+
+        if info.drivername.startswith('postgresql'):
+            connect_args = options.setdefault('connect_args', {})
+            connect_args['options'] = ' '.join(
+                '-c {}={:d}'.format(setting, app.config[key])
+                for setting, key in (
+                    ('statement_timeout', 'DATABASE_STATEMENT_TIMEOUT'),
+                    ('idle_in_transaction_session_timeout',
+                     'DATABASE_IDLE_IN_TRANSACTION_TIMEOUT')))
+            if self.is_replica(app, info):
+                connect_args['connect_timeout'] = \
+                    app.config['REPLICA_CONNECT_TIMEOUT']
+
+    def is_replica(self, app, info):
+        """Check whether a database URL is one of the read replicas."""
+
+        binds = app.config.get('SQLALCHEMY_BINDS') or {}
+        return any(make_url(binds[key]) == info
+                   for key in app.config['SQLALCHEMY_REPLICA_BINDS']
+                   if key in binds)
+
+    def pool_stats(self, app=None):
+        """Report the metrics of the connection pool of an application.
+
+        Returns:
+            A dictionary with the pool class and, for measured pools, the
+            PoolMetrics statistics.
+        """
+        pool = self.get_engine(app).pool
+        stats = {'pool': type(pool).__name__}
+        if isinstance(pool, InstrumentedQueuePool):
+            stats.update(pool.metrics.stats(pool))
+        router = self.get_router(app)
+        if router is not None:
+            stats['replicas'] = router.stats()
+        return stats
+
+
+def last_write_serializer():
+    return URLSafeTimedSerializer(
+        current_app.config['JWT_SECRET_KEY'], salt='last-write-salt')
+
+
+def wrote_recently():
+    """Check whether the user of the request wrote a moment ago, through
+    this worker or according to the X-Last-Write header of the request."""
+
+    identity = get_jwt_identity()
+    seconds = current_app.config['REPLICA_READ_YOUR_WRITES_SECONDS']
+    if identity is None or seconds <= 0:
+        return False
+    if current_app.extensions['recent_writers'].wrote_within(
+            identity, seconds):
+        return True
+    token = request.headers.get(LAST_WRITE_HEADER)
+    if not token:
+        return False
+    try:
+        writer = last_write_serializer().loads(token, max_age=seconds)
+    except BadSignature:
+        return False
+    return writer == identity
+
+
+def read_from_replica(method):
+    """Run a read-only resource method against a read replica.
+
+    Reads stay on the primary when no replica is configured or healthy,
+    and for a user that wrote within REPLICA_READ_YOUR_WRITES_SECONDS. The
+    token must be verified first, place it under `jwt_required`.
+    """
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        db = current_app.extensions['sqlalchemy'].db
+        router = db.get_router()
+        if router is None or wrote_recently():
+            return method(*args, **kwargs)
+        session = db.session()
+        session.replica = router.choose()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            session.replica = None
+    return wrapper
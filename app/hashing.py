@@ -0,0 +1,110 @@
+"""Hash and verify passwords outside the request threads.
+
+Password hashing is deliberately slow, so running it on the request thread
+lets a burst of logins take every worker away from cheap endpoints. The
+work is sent to a pool of PASSWORD_HASH_WORKERS processes instead, and at
+most PASSWORD_HASH_CONCURRENCY requests of a worker wait on it at once, a
+request that cannot get a slot within PASSWORD_HASH_TIMEOUT seconds fails
+with HasherBusy, as does a hash that takes longer than that in the pool.
+Setting PASSWORD_HASH_WORKERS to 0 hashes inline.
+
+Hashes are generated with PASSWORD_HASH_METHOD and
+PASSWORD_HASH_ITERATIONS. Stored hashes remember the parameters they were
+made with, so a hash made with other parameters is replaced the next time
+its owner logs in.
+
+"""
+
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HasherBusy(Exception):
+
+    """Raised when too many requests are already waiting for the pool."""
+
+
+class PasswordHasher(object):
+
+    """Run werkzeug password hashing in a bounded process pool."""
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self.method = 'pbkdf2:sha256'
+        self.workers = 0
+        self.timeout = None
+        self._slots = threading.BoundedSemaphore(1)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PASSWORD_HASH_METHOD', 'pbkdf2:sha256')
+        app.config.setdefault('PASSWORD_HASH_ITERATIONS', 150000)
+        app.config.setdefault('PASSWORD_HASH_WORKERS', 2)
+        app.config.setdefault('PASSWORD_HASH_CONCURRENCY', 16)
+        app.config.setdefault('PASSWORD_HASH_TIMEOUT', 10)
+        self.shutdown()
+        self.method = '{}:{}'.format(app.config['PASSWORD_HASH_METHOD'],
+                                     app.config['PASSWORD_HASH_ITERATIONS'])
+        self.workers = app.config['PASSWORD_HASH_WORKERS']
+        self.timeout = app.config['PASSWORD_HASH_TIMEOUT']
+        self._slots = threading.BoundedSemaphore(
+            app.config['PASSWORD_HASH_CONCURRENCY'])
+
+    def hash(self, password):
+        """Hash a password with the configured method and iterations."""
+
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        """Check a password against a stored hash.
+
+        Returns:
+            Boolean value.
+        """
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """Check whether a hash was made with outdated parameters."""
+
+        return pwhash.split('$', 1)[0] != self.method
+
+    def shutdown(self):
+        """Stop the worker processes, they are started again on use."""
+
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def _run(self, function, *args):
+        if not self.workers:
+            return function(*args)
+        if not self._slots.acquire(timeout=self.timeout):
+            raise HasherBusy('Too many password checks in progress!')
+        try:
+            future = self._get_executor().submit(function, *args)
+            try:
+                return future.result(timeout=self.timeout)
+            except FutureTimeout:
+                future.cancel()
+                raise HasherBusy('Password check timed out!')
+        finally:
+            self._slots.release()
+
+    def _get_executor(self):
+        # Each forked server process needs processes of its own.
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(self.workers)
+                self._pid = os.getpid()
+            return self._executor
+
+
+password_hasher = PasswordHasher()
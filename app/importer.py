@@ -0,0 +1,190 @@
+"""Import businesses in bulk from NDJSON or CSV files.
+
+Records are parsed lazily from the uploaded stream and written a chunk of
+BUSINESS_IMPORT_CHUNK_SIZE rows at a time. Names are checked against the
+business table with one IN query per chunk and the new rows are inserted
+with one multi-row INSERT. On Postgres the insert skips names registered
+concurrently with ON CONFLICT DO NOTHING and returns the new ids, other
+databases insert the chunk with executemany and read the ids back.
+
+"""
+
+import csv
+import json
+from itertools import islice
+from types import SimpleNamespace
+
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
+
+from app.models import Business, User
+from app.models import db
+
+FORMATS = ('ndjson', 'csv')
+REQUIRED_FIELDS = ('name', 'category', 'location', 'summary')
+
+
+def read_records(stream, data_format='ndjson'):
+    """Parse business records from a text stream one at a time.
+
+    Args:
+        stream(file): text stream of NDJSON lines or CSV with a header row.
+        data_format(str): 'ndjson' or 'csv'.
+
+    Returns:
+        A generator of (record, error) tuples, error is None for records
+        that could be parsed.
+    """
+    if data_format == 'csv':
+        for record in csv.DictReader(stream):
+            yield record, None
+        return
+
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        if isinstance(record, dict):
+            yield record, None
+        else:
+            yield None, 'Invalid JSON record!'
+
+
+def clean_record(record):
+    """Validate a business record against the business table constraints.
+
+    Args:
+        record(dict): parsed record.
+
+    Returns:
+        A (values, error) tuple, values is None when error is set.
+    """
+    values = {}
+    for field in REQUIRED_FIELDS:
+        value = record.get(field)
+        if not isinstance(value, str) or not value.strip():
+            return None, \
+                'Business name, category, location and summary are required!'
+        values[field] = value.strip()
+    for field in ('name', 'category', 'location'):
+        length = Business.__table__.c[field].type.length
+        if len(values[field]) > length:
+            return None, 'Business {} is longer than {} characters!'.format(
+                field, length)
+    values['category'] = values['category'].lower()
+    return values, None
+
+
+class BusinessImporter(object):
+
+    """Insert business records in chunks and report the outcome of each."""
+
+    def __init__(self, created_by, chunk_size=1000, on_created=None):
+        """
+        Args:
+            created_by(int): id of the user owning the imported businesses.
+            chunk_size(int): records inserted per transaction.
+            on_created(callable): called with every created business, as
+                an object with the column attributes, used to update the
+                search indexes.
+        """
+        self.created_by = created_by
+        self.chunk_size = chunk_size
+        self.on_created = on_created
+        self.results = []
+        self.created = 0
+        self._names = set()
+
+    def run(self, records):
+        """Import parsed records.
+
+        Args:
+            records(iterable): (record, error) tuples from read_records.
+
+        Returns:
+            A dictionary with the number of created and skipped rows and
+            the result of every row.
+        """
+        records = iter(records)
+        row = 0
+        while True:
+            chunk = list(islice(records, self.chunk_size))
+            if not chunk:
+                break
+            self._import_chunk(enumerate(chunk, start=row + 1))
+            row += len(chunk)
+        return {
+            'created': self.created,
+            'skipped': len(self.results) - self.created,
+            'results': self.results
+        }
+
+    def _import_chunk(self, numbered_records):
+        pending = []
+        for row, (record, error) in numbered_records:
+            values = None
+            if error is None:
+                values, error = clean_record(record)
+            result = {'row': row, 'name': (record or {}).get('name')}
+            self.results.append(result)
+            if error is not None:
+                result.update(status='invalid', response_message=error)
+            elif values['name'] in self._names:
+                result.update(status='duplicate', response_message=(
+                    'Business name already registered!'))
+            else:
+                self._names.add(values['name'])
+                values['created_by'] = self.created_by
+                pending.append((result, values))
+        if not pending:
+            return
+
+        created = self._insert([values for _, values in pending])
+        for result, values in pending:
+            business_id = created.get(values['name'])
+            if business_id is None:
+                result.update(status='duplicate', response_message=(
+                    'Business name already registered!'))
+                continue
+            result.update(status='created', id=business_id)
+            self.created += 1
+            if self.on_created is not None:
+                self.on_created(SimpleNamespace(id=business_id, **values))
+
+    def _insert(self, rows, retry=True):
+        """Insert the rows whose names are not registered yet.
+
+        Returns:
+            A dictionary of inserted name to business id.
+        """
+        names = [row['name'] for row in rows]
+        registered = {name for name, in db.session.query(
+            Business.name).filter(Business.name.in_(names))}
+        rows = [row for row in rows if row['name'] not in registered]
+        if not rows:
+            return {}
+
+        table = Business.__table__
+        if db.engine.dialect.name == 'postgresql':
+            statement = pg_insert(table).values(rows).on_conflict_do_nothing(
+                index_elements=['name']).returning(table.c.id, table.c.name)
+            created = {name: business_id for business_id, name in
+                       db.session.execute(statement)}
+        else:
+            try:
+                db.session.execute(table.insert(), rows)
+            except IntegrityError:
+                # A name was registered since it was checked, check again.
+                db.session.rollback()
+                if not retry:
+                    raise
+                return self._insert(rows, retry=False)
+            created = dict(db.session.query(Business.name, Business.id).filter(
+                Business.name.in_([row['name'] for row in rows])))
+        if created:
+            User.count_businesses(self.created_by, len(created))
+        db.session.commit()
+        return created
@@ -0,0 +1,339 @@
+"""Deliver outgoing mail from a durable outbox.
+
+Views never talk to the SMTP server. `send_mail` stores the message in the
+mail_outbox table and returns, and the queue is drained by
+`python manage.py process_mail_queue`, or by a background thread every
+MAIL_WORKER_INTERVAL seconds when that is set.
+
+Messages are sent in batches over SMTP connections kept open between
+runs by SMTPPool, up to MAIL_POOL_SIZE of them. An idle connection is
+checked with NOOP before it is reused and replaced when the server closed
+it, so only the first batch after a quiet period pays for the TLS
+handshake and login.
+
+A message that fails to send is retried after MAIL_RETRY_BASE_SECONDS,
+doubling the delay on every attempt up to MAIL_RETRY_MAX_SECONDS, and is
+marked failed after MAIL_MAX_ATTEMPTS attempts. Messages are claimed for
+MAIL_CLAIM_SECONDS before they are sent so that several workers can drain
+the same outbox, a claim left by a worker that died expires on its own.
+No transaction is open while the batch talks to the SMTP server, the
+outcome of every message is recorded in a transaction of its own.
+
+"""
+
+import logging
+import smtplib
+import threading
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from flask import current_app
+from flask_mail import Mail, Message
+
+from app.models import OutboxMail
+from app.models import db
+
+logger = logging.getLogger(__name__)
+
+mail = Mail()
+
+
+class SMTPPool(object):
+
+    """Reuse open SMTP connections of the current application."""
+
+    def __init__(self, size=2, idle_seconds=60):
+        self.size = size
+        self.idle_seconds = idle_seconds
+        self._idle = []
+        self._lock = threading.Lock()
+        self.counters = {
+            'sent': 0,
+            'failed': 0,
+            'batches': 0,
+            'connections': 0,
+            'reconnects': 0,
+            'send_seconds': 0.0,
+            'max_send_seconds': 0.0
+        }
+
+    def acquire(self):
+        """Return a healthy connection, opening one when none is idle."""
+
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                connection, released_at = self._idle.pop()
+            if self.is_healthy(connection, released_at):
+                return connection
+            self.close(connection)
+        return self.open()
+
+    def release(self, connection):
+        """Keep a connection for the next batch, or close it when full."""
+
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append((connection, time.time()))
+                return
+        self.close(connection)
+
+    def open(self):
+        """Connect and log in to the configured SMTP server."""
+
+        # Entered here and left in close() since the connection outlives
+        # the batch that opened it.
+        connection = mail.connect().__enter__()
+        with self._lock:
+            self.counters['connections'] += 1
+        return connection
+
+    def close_all(self):
+        """Quit every idle connection."""
+
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection, _ in idle:
+            self.close(connection)
+
+    @staticmethod
+    def close(connection):
+        """Quit a connection, dropping it if the server already left."""
+
+        try:
+            connection.__exit__(None, None, None)
+        except (smtplib.SMTPException, OSError):
+            connection.host.close()
+
+    def is_healthy(self, connection, released_at):
+        """Check an idle connection before it is reused."""
+
+        if connection.host is None:
+            return True
+        if time.time() - released_at > self.idle_seconds:
+            return False
+        try:
+            return connection.host.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def send_batch(self, messages):
+        """Send messages over one connection.
+
+        A connection dropped by the server is reopened once and the
+        message that hit the disconnection is sent again.
+
+        Args:
+            messages(list): flask_mail Message instances.
+
+        Returns:
+            A list with the error raised by every message, None for the
+            messages that were sent.
+        """
+        errors = []
+        connection = self.acquire()
+        try:
+            for message in messages:
+                started = time.time()
+                try:
+                    try:
+                        connection.send(message)
+                    except (smtplib.SMTPServerDisconnected, ConnectionError):
+                        self.close(connection)
+                        connection = self.open()
+                        with self._lock:
+                            self.counters['reconnects'] += 1
+                        connection.send(message)
+                except Exception as error:
+                    errors.append(error)
+                else:
+                    errors.append(None)
+                self._count(time.time() - started, errors[-1] is None)
+        except Exception:
+            self.close(connection)
+            raise
+        self.release(connection)
+        with self._lock:
+            self.counters['batches'] += 1
+        return errors
+
+    def _count(self, seconds, sent):
+        with self._lock:
+            self.counters['sent' if sent else 'failed'] += 1
+            self.counters['send_seconds'] += seconds
+            self.counters['max_send_seconds'] = max(
+                self.counters['max_send_seconds'], seconds)
+
+    def stats(self):
+        """Report delivery throughput and latency.
+
+        Returns:
+            A dictionary of the counters, with the average latency in
+            milliseconds and the messages sent per second of SMTP time.
+        """
+        with self._lock:
+            stats = dict(self.counters)
+            stats['idle'] = len(self._idle)
+        attempts = stats['sent'] + stats['failed']
+        stats['avg_send_ms'] = round(
+            1000 * stats['send_seconds'] / attempts, 3) if attempts else 0.0
+        stats['max_send_ms'] = round(1000 * stats['max_send_seconds'], 3)
+        stats['messages_per_second'] = round(
+            stats['sent'] / stats['send_seconds'], 3) \
+            if stats['send_seconds'] else 0.0
+        return stats
+
+
+class MailQueue(object):
+
+    """Store outgoing mail in the outbox and deliver it with retries."""
+
+    def __init__(self, app=None):
+        self.pool = SMTPPool()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MAIL_QUEUE_BATCH_SIZE', 50)
+        app.config.setdefault('MAIL_MAX_ATTEMPTS', 8)
+        app.config.setdefault('MAIL_RETRY_BASE_SECONDS', 30)
+        app.config.setdefault('MAIL_RETRY_MAX_SECONDS', 3600)
+        app.config.setdefault('MAIL_CLAIM_SECONDS', 300)
+        app.config.setdefault('MAIL_WORKER_INTERVAL', None)
+        app.config.setdefault('MAIL_POOL_SIZE', 2)
+        app.config.setdefault('MAIL_POOL_IDLE_SECONDS', 60)
+        mail.init_app(app)
+        self.pool = SMTPPool(app.config['MAIL_POOL_SIZE'],
+                             app.config['MAIL_POOL_IDLE_SECONDS'])
+        if app.config['MAIL_WORKER_INTERVAL']:
+            self.start_worker(app, app.config['MAIL_WORKER_INTERVAL'])
+
+    @staticmethod
+    def enqueue(recipient, subject, body):
+        """Store a message for delivery by the worker.
+
+        Args:
+            recipient(str): email address of the recipient.
+            subject(str): message subject.
+            body(str): plain text message body.
+
+        Returns:
+            The stored OutboxMail record.
+        """
+        message = OutboxMail(recipient, subject, body)
+        message.save()
+        return message
+
+    def start_worker(self, app, interval):
+        """Drain the outbox every `interval` seconds.
+
+        Args:
+            app(Flask): application providing the mail configuration.
+            interval(int): seconds between two runs.
+
+        Returns:
+            The started daemon thread.
+        """
+        def work():
+            while True:
+                time.sleep(interval)
+                with app.app_context():
+                    try:
+                        self.process()
+                    except Exception:
+                        db.session.rollback()
+                        logger.exception('Processing the mail queue failed')
+                    finally:
+                        db.session.remove()
+
+        thread = threading.Thread(
+            target=work, name='mail-queue-worker', daemon=True)
+        thread.start()
+        return thread
+
+    def process(self, batch_size=None, now=None):
+        """Send the messages that are due.
+
+        Args:
+            batch_size(int): maximum number of messages to send, defaults
+                to MAIL_QUEUE_BATCH_SIZE.
+            now(datetime): current UTC time.
+
+        Returns:
+            A dictionary with the number of sent, retried and failed
+            messages.
+        """
+        config = current_app.config
+        now = now or datetime.utcnow()
+        messages = self.claim(
+            batch_size or config['MAIL_QUEUE_BATCH_SIZE'], now)
+        counts = {'sent': 0, 'retried': 0, 'failed': 0}
+        if not messages:
+            return counts
+        try:
+            errors = self.pool.send_batch([Message(
+                subject=message.subject,
+                sender=config['MAIL_DEFAULT_SENDER'],
+                recipients=[message.recipient],
+                body=message.body) for message in messages])
+        except Exception as error:
+            # No connection to the server could be opened.
+            errors = [error] * len(messages)
+        for message, error in zip(messages, errors):
+            if error is not None:
+                attempts = message.attempts + 1
+                outcome = {'attempts': attempts, 'last_error': str(error)}
+                if attempts >= config['MAIL_MAX_ATTEMPTS']:
+                    outcome['status'] = 'failed'
+                    counts['failed'] += 1
+                else:
+                    outcome['next_attempt_at'] = now + timedelta(
+                        seconds=self.retry_delay(attempts))
+                    counts['retried'] += 1
+                logger.warning('Sending mail %d failed: %s',
+                               message.id, error)
+            else:
+                outcome = {'status': 'sent', 'sent_at': datetime.utcnow()}
+                counts['sent'] += 1
+            OutboxMail.query.filter_by(id=message.id).update(
+                outcome, synchronize_session=False)
+            db.session.commit()
+        return counts
+
+    @staticmethod
+    def claim(batch_size, now):
+        """Reserve due messages for this worker.
+
+        Returns:
+            A list of detached copies of the claimed messages, reading
+            them does not go back to the database.
+        """
+        messages = OutboxMail.query.filter(
+            OutboxMail.status == 'pending',
+            OutboxMail.next_attempt_at <= now).order_by(
+                OutboxMail.next_attempt_at).limit(
+                    batch_size).with_for_update(skip_locked=True).all()
+        claimed_until = now + timedelta(
+            seconds=current_app.config['MAIL_CLAIM_SECONDS'])
+        claimed = []
+        for message in messages:
+            message.next_attempt_at = claimed_until
+            claimed.append(SimpleNamespace(
+                id=message.id, recipient=message.recipient,
+                subject=message.subject, body=message.body,
+                attempts=message.attempts))
+        db.session.commit()
+        return claimed
+
+    @staticmethod
+    def retry_delay(attempts):
+        """Return the seconds to wait before the next attempt."""
+
+        config = current_app.config
+        return min(config['MAIL_RETRY_BASE_SECONDS'] * 2 ** (attempts - 1),
+                   config['MAIL_RETRY_MAX_SECONDS'])
+
+
+mail_queue = MailQueue()
@@ -1,12 +1,29 @@
 """Demonstrate all models."""
 
-from werkzeug.security import generate_password_hash, check_password_hash
-from flask_sqlalchemy import SQLAlchemy
+import sqlite3
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.database import SQLAlchemy
+from app.hashing import password_hasher
 
 
 db = SQLAlchemy()
 
 
+@event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    """Make SQLite enforce foreign keys and their ON DELETE CASCADE."""
+
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
+
 class User(db.Model):
     """Create users table."""
 
@@ -17,10 +34,18 @@ class User(db.Model):
     first_name = db.Column(db.String(60), nullable=True)
     last_name = db.Column(db.String(60), nullable=True)
     password = db.Column(db.String(120), nullable=False)
+    token_version = db.Column(
+        db.Integer, nullable=False, default=0, server_default='0')
+    business_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default='0')
+    # Children are removed by ON DELETE CASCADE instead of being loaded
+    # and deleted one by one.
     businesses = db.relationship(
-        'Business', order_by='Business.id', cascade='all, delete-orphan')
+        'Business', order_by='Business.id', cascade='all, delete-orphan',
+        passive_deletes=True)
     _reviews = db.relationship(
-        'Reviews', order_by='Reviews.id', cascade='all, delete-orphan')
+        'Reviews', order_by='Reviews.id', cascade='all, delete-orphan',
+        passive_deletes=True)
 
     def __init__(self, email, username, password):
         self.email = email.lower()
@@ -28,25 +53,80 @@ class User(db.Model):
         self.password = self.set_password(password)
 
     def set_password(self, password):
-        return generate_password_hash(password)
+        return password_hasher.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password, password)
+        return password_hasher.verify(self.password, password)
+
+    @classmethod
+    def upgrade_password(cls, user_id, pwhash, password):
+        """Rehash a verified password made with outdated parameters.
+
+        Args:
+            user_id(int): id of the user logging in.
+            pwhash(str): stored password hash.
+            password(str): plain password that matched the stored hash.
+        """
+
+        if not password_hasher.needs_rehash(pwhash):
+            return
+        cls.query.filter_by(id=user_id).update(
+            {cls.password: password_hasher.hash(password)},
+            synchronize_session=False)
+        db.session.commit()
+
+    @classmethod
+    def count_businesses(cls, user_id, added):
+        """Adjust the number of businesses owned by a user.
+
+        The update joins the transaction that adds or removes the
+        businesses and is committed with it.
+
+        Args:
+            user_id(int): id of the business owner.
+            added(int): businesses created, negative when they are deleted.
+        """
+
+        cls.query.filter_by(id=user_id).update(
+            {cls.business_count: cls.business_count + added},
+            synchronize_session=False)
+
+    @classmethod
+    def bump_token_version(cls, user_id):
+        """Invalidate every token issued to a user so far.
+
+        Args:
+            user_id(int): id of the user logging out.
+        """
+
+        cls.query.filter_by(id=user_id).update(
+            {cls.token_version: cls.token_version + 1},
+            synchronize_session=False)
+        db.session.commit()
 
     def save(self):
         db.session.add(self)
         db.session.commit()
 
 
+# Emails and usernames are stored lowered, the lowered unique indexes
+# keep a differently cased duplicate out even when written directly.
+db.Index('ix_users_lower_email', db.func.lower(User.email), unique=True)
+db.Index('ix_users_lower_username', db.func.lower(User.username),
+         unique=True)
+
+
 class RevokedToken(db.Model):
     """Create revoked_tokens table."""
 
     __tablename__ = 'revoked_tokens'
     tid = db.Column(db.Integer, primary_key=True)
-    jti = db.Column(db.String(120))
+    jti = db.Column(db.String(120), unique=True, index=True)
+    expires_at = db.Column(db.DateTime, nullable=True, index=True)
 
-    def __init__(self, jti):
+    def __init__(self, jti, expires_at=None):
         self.jti = jti
+        self.expires_at = expires_at
 
     @classmethod
     def is_jti_blacklisted(cls, jti):
@@ -61,6 +141,34 @@ class RevokedToken(db.Model):
         query = cls.query.filter_by(jti=jti).first()
         return bool(query)
 
+    @classmethod
+    def prune_expired(cls, batch_size=1000, now=None):
+        """Delete revoked tokens that have expired anyway.
+
+        Rows are deleted in batches, each in its own short transaction, so
+        the table is never locked for long. Tokens without an expiry are
+        kept.
+
+        Args:
+            batch_size(int): maximum number of rows deleted per transaction.
+            now(datetime): expiry cut-off, defaults to the current UTC time.
+
+        Returns:
+            The number of deleted rows.
+        """
+        now = now or datetime.utcnow()
+        deleted = 0
+        while True:
+            expired = [tid for tid, in db.session.query(cls.tid).filter(
+                cls.expires_at.isnot(None),
+                cls.expires_at < now).order_by(cls.tid).limit(batch_size)]
+            if not expired:
+                return deleted
+            cls.query.filter(cls.tid.in_(expired)).delete(
+                synchronize_session=False)
+            db.session.commit()
+            deleted += len(expired)
+
     def save(self):
         db.session.add(self)
         db.session.commit()
@@ -70,15 +178,28 @@ class Business(db.Model):
     """Create business table."""
 
     __tablename__ = 'business'
+    __table_args__ = (
+        db.Index('ix_business_created_by_id', 'created_by', 'id'),
+        db.Index('ix_business_updated_at_id', 'updated_at', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(60), unique=True, nullable=False)
     category = db.Column(db.String(40), nullable=False)
     location = db.Column(db.String(40), nullable=False)
     summary = db.Column(db.Text, nullable=False)
-    created_by = db.Column(db.Integer, db.ForeignKey(User.id))
+    created_by = db.Column(
+        db.Integer, db.ForeignKey(User.id, ondelete='CASCADE'))
+    version = db.Column(
+        db.Integer, nullable=False, default=1, server_default='1')
+    review_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default='0')
+    # Lets the search indexes of every worker catch up on changed rows.
+    updated_at = db.Column(
+        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     _reviews = db.relationship(
-        'Reviews', order_by='Reviews.id', cascade='all, delete-orphan')
+        'Reviews', order_by='Reviews.id', cascade='all, delete-orphan',
+        passive_deletes=True)
 
     def __init__(self, name, category, location, summary, created_by):
         self.name = name
@@ -88,25 +209,107 @@ class Business(db.Model):
         self.created_by = created_by
 
     def save(self):
+        if self.id is None and self.created_by is not None:
+            User.count_businesses(self.created_by, 1)
         db.session.add(self)
         db.session.commit()
 
 
+# Lowered expression indexes serve the case-insensitive prefix search,
+# text_pattern_ops lets Postgres use them for LIKE 'prefix%' regardless of
+# the database collation, as in the migration.
+db.Index('ix_business_lower_name',
+         db.func.lower(Business.name).label('lower_name'),
+         postgresql_ops={'lower_name': 'text_pattern_ops'})
+db.Index('ix_business_lower_category',
+         db.func.lower(Business.category).label('lower_category'),
+         postgresql_ops={'lower_category': 'text_pattern_ops'})
+db.Index('ix_business_lower_location',
+         db.func.lower(Business.location).label('lower_location'),
+         postgresql_ops={'lower_location': 'text_pattern_ops'})
+
+
 class Reviews(db.Model):
     """Create reviews table."""
 
     __tablename__ = 'reviews'
+    __table_args__ = (
+        db.Index('ix_reviews_review_for_id', 'review_for', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     review = db.Column(db.Text, nullable=False)
-    review_for = db.Column(db.Integer, db.ForeignKey(Business.id))
-    reviewed_by = db.Column(db.Integer, db.ForeignKey(User.id))
+    review_for = db.Column(
+        db.Integer, db.ForeignKey(Business.id, ondelete='CASCADE'))
+    reviewed_by = db.Column(
+        db.Integer, db.ForeignKey(User.id, ondelete='CASCADE'))
 
     def __init__(self, review, review_for, reviewed_by):
         self.review = review
         self.review_for = review_for
         self.reviewed_by = reviewed_by
 
+    def save(self):
+        """Insert the review and count it on its business."""
+
+        db.session.add(self)
+        Business.query.filter_by(id=self.review_for).update(
+            {Business.review_count: Business.review_count + 1},
+            synchronize_session=False)
+        db.session.commit()
+
+    @classmethod
+    def bulk_save(cls, reviews):
+        """Insert many reviews and count them in a single transaction.
+
+        Args:
+            reviews(list): dictionaries with review, review_for and
+                reviewed_by keys.
+        """
+        if not reviews:
+            return
+        db.session.execute(cls.__table__.insert(), reviews)
+        added = Counter(review['review_for'] for review in reviews)
+        business = Business.__table__
+        db.session.execute(
+            business.update().where(
+                business.c.id == db.bindparam('business_id')).values(
+                    review_count=business.c.review_count +
+                    db.bindparam('added')),
+            [{'business_id': business_id, 'added': count}
+             for business_id, count in added.items()])
+        db.session.commit()
+
+
+class OutboxMail(db.Model):
+    """Create mail_outbox table."""
+
+    __tablename__ = 'mail_outbox'
+    __table_args__ = (
+        db.Index('ix_mail_outbox_status_next_attempt_at',
+                 'status', 'next_attempt_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(60), nullable=False)
+    subject = db.Column(db.String(120), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(10), nullable=False, default='pending',
+                       server_default='pending')
+    attempts = db.Column(
+        db.Integer, nullable=False, default=0, server_default='0')
+    next_attempt_at = db.Column(
+        db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(
+        db.DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    def __init__(self, recipient, subject, body):
+        self.recipient = recipient
+        self.subject = subject
+        self.body = body
+
     def save(self):
         db.session.add(self)
         db.session.commit()
@@ -5,11 +5,16 @@ reviews and view reviews fo a single business.
 
 """
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, current_app, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from flask_restful import Resource, Api
 
-from app.models import Business, Reviews
+from app.database import read_from_replica
+from app.encoding import jsonify, output_json
+from app.models import Business, Reviews, User
+from app.models import db
+from app.utils import (
+    get_keyset_page, get_page_size, not_modified, review_error)
 
 
 class BusinessReviews(Resource):
@@ -75,9 +80,10 @@ class BusinessReviews(Resource):
                 'status_code': 404
             })
             return response
-        if not business_review:
+        error = review_error(business_review)
+        if error is not None:
             response = jsonify({
-                'response_message': 'Review field is required!',
+                'response_message': error,
                 'status_code': 406})
             return response
 
@@ -106,6 +112,7 @@ class BusinessReviews(Resource):
             return response
 
     @jwt_required
+    @read_from_replica
     def get(self, business_id):
         """View reviews for a business.
         ---
@@ -123,6 +130,23 @@ class BusinessReviews(Resource):
                 type: string
                 required: true
                 x-authentication: Bearer
+            -   in: query
+                name: after_id
+                description: id of the last review of the previous page
+                required: false
+                schema:
+                    type: integer
+            -   in: query
+                name: limit
+                description: maximum number of reviews in the page
+                required: false
+                schema:
+                    type: integer
+            -   in: header
+                name: If-None-Match
+                description: ETag of a previously fetched copy
+                type: string
+                required: false
         responses:
             200:
                 description: A dictionary of business reviews
@@ -137,6 +161,17 @@ class BusinessReviews(Resource):
                         reviewed_by:
                             type: integer
                             description: user id of the user who reviewed
+                        reviewer_username:
+                            type: string
+                            description: username of the user who reviewed
+                        total:
+                            type: integer
+                            description: number of reviews of the business
+                        next_cursor:
+                            type: integer
+                            description: after_id of the next page
+            304:
+                description: The copy matching If-None-Match is current
             404:
                 description: Business is not registered
                 schema:
@@ -159,30 +194,51 @@ class BusinessReviews(Resource):
         """
         if not business_id:
             return 404
-        business = Business.query.filter_by(id=business_id).first()
-        if business is None:
+        review_count = db.session.query(Business.review_count).filter_by(
+            id=business_id).scalar()
+        if review_count is None:
             response = jsonify({
                 'response_message': 'Business id is not registered!',
                 'status_code': 404
             })
             return response
-        business_reviews = Reviews.query.filter_by(
-            review_for=business_id).all()
+        etag = 'reviews-%d-%d' % (business_id, review_count)
+        response = not_modified(etag)
+        if response is not None:
+            return response
 
-        if business_reviews:
+        if review_count:
             try:
+                after_id = request.args.get('after_id', type=int)
+                page_size = get_page_size(request.args.get('limit', type=int))
+                business_reviews = db.session.query(
+                    Reviews, User.username).outerjoin(
+                        User, Reviews.reviewed_by == User.id).filter(
+                            Reviews.review_for == business_id)
+                rows, next_cursor = get_keyset_page(
+                    business_reviews, Reviews.id, after_id, page_size)
                 _reviews = []
 
-                for _review in business_reviews:
+                for _review, user_name in rows:
                     _object = {
                         'id': _review.id,
                         'review': _review.review,
                         'reviewed_by': _review.reviewed_by,
+                        'reviewer_username': user_name
                     }
                     _reviews.append(_object)
-                response = jsonify(reviews_list=_reviews)
+                response = jsonify({
+                    'reviews_list': _reviews,
+                    'total': review_count,
+                    'limit': page_size,
+                    'next_cursor': next_cursor,
+                    'next': '' if next_cursor is None else
+                    '/api/v2/businesses/%d/reviews?after_id=%d&limit=%d' % (
+                        business_id, next_cursor, page_size)
+                })
 
                 response.status_code = 200
+                response.set_etag(etag)
                 return response
             except Exception as error:
                 response = jsonify({
@@ -198,7 +254,130 @@ class BusinessReviews(Resource):
             return response
 
 
+class BatchReviews(Resource):
+
+    """Illustrate API endpoint to add many business reviews at once."""
+
+    @jwt_required
+    def post(self):
+        """Add reviews for several businesses.
+        ---
+        tags:
+            -   business reviews
+        parameters:
+            -   in: header
+                name: authorization
+                description: JSON Web Token
+                type: string
+                required: true
+                x-authentication: Bearer
+            -   in: body
+                name: reviews
+                required: true
+                schema:
+                    required:
+                        - reviews
+                    properties:
+                        reviews:
+                            type: array
+                            items:
+                                properties:
+                                    business_id:
+                                        type: integer
+                                    review:
+                                        type: string
+        responses:
+            201:
+                description: Status of every review, in request order
+                schema:
+                    properties:
+                        created:
+                            type: integer
+                        results:
+                            type: array
+            406:
+                description: Missing or too many reviews
+                schema:
+                    properties:
+                        response_message:
+                            type: string
+            500:
+                description: Internal server error
+                schema:
+                    properties:
+                        response_message:
+                            type: string
+        """
+        request_data = request.get_json(force=True) or {}
+        items = request_data.get('reviews')
+        created_by = get_jwt_identity()
+
+        if not isinstance(items, list) or not items:
+            response = jsonify({
+                'response_message': 'Reviews field is required!',
+                'status_code': 406})
+            return response
+        max_items = current_app.config['REVIEW_BATCH_MAX_ITEMS']
+        if len(items) > max_items:
+            response = jsonify({
+                'response_message':
+                    'At most {} reviews are allowed!'.format(max_items),
+                'status_code': 406})
+            return response
+
+        business_ids = {
+            item.get('business_id') for item in items
+            if isinstance(item, dict) and
+            isinstance(item.get('business_id'), int)}
+        registered = {business_id for business_id, in db.session.query(
+            Business.id).filter(Business.id.in_(business_ids))} \
+            if business_ids else set()
+
+        results = []
+        reviews = []
+        for index, item in enumerate(items):
+            error = review_error(item.get('review')) \
+                if isinstance(item, dict) else 'Review field is required!'
+            if error is not None:
+                results.append({
+                    'index': index,
+                    'response_message': error,
+                    'status_code': 406})
+            elif item.get('business_id') not in registered:
+                results.append({
+                    'index': index,
+                    'response_message': 'Business not registered!',
+                    'status_code': 404})
+            else:
+                reviews.append({
+                    'review': item['review'],
+                    'review_for': item['business_id'],
+                    'reviewed_by': created_by})
+                results.append({
+                    'index': index,
+                    'response_message': 'Review has been added successfully!',
+                    'status_code': 201})
+
+        try:
+            Reviews.bulk_save(reviews)
+        except Exception as error:
+            db.session.rollback()
+            response = jsonify({
+                'response_message': str(error),
+                'status_code': 500})
+            return response
+        response = jsonify({
+            'created': len(reviews),
+            'results': results,
+            'status_code': 201
+        })
+        response.status_code = 201
+        return response
+
+
 reviews_api = Blueprint('reviews.views', __name__)
 api = Api(reviews_api)
+api.representation('application/json')(output_json)
 api.add_resource(BusinessReviews,
                  '/businesses/<int:business_id>/reviews', endpoint='reviews')
+api.add_resource(BatchReviews, '/reviews/batch', endpoint='batch_reviews')
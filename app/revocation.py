@@ -0,0 +1,320 @@
+"""Cache revoked JWT identifiers in memory.
+
+Every protected request asks whether its token was revoked. Almost all of
+them were not, so this module answers that question from a Bloom filter of
+revoked jtis kept in each worker, and only goes to the revoked_tokens table
+when the filter reports a possible match that is not already in the LRU of
+confirmed revocations. The filter is topped up from rows added by other
+workers at most every REVOCATION_REFRESH_SECONDS. Token ids are not
+committed in order, so every refresh reads again the last
+REVOCATION_REFRESH_MARGIN ids before the highest one it has seen.
+
+With JWT_REVOCATION_MODE = 'epoch', access tokens instead carry the
+owner's token_version as a claim and logging out bumps that counter, so
+validation is a comparison with the user's epoch, cached for
+REVOCATION_EPOCH_TTL seconds. Refresh tokens cannot carry claims and keep
+using the revoked_tokens table in both modes.
+
+Revoked tokens that are past their expiry are deleted by
+`python manage.py prune_revoked_tokens`, or by a background thread every
+REVOKED_TOKEN_PRUNE_INTERVAL seconds when that is set.
+
+"""
+
+import hashlib
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from datetime import datetime
+
+from flask import current_app
+
+from app.models import RevokedToken, User
+from app.models import db
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter(object):
+
+    """Fixed size Bloom filter of strings."""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = int(math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, int(round(
+            self.size / float(capacity) * math.log(2))))
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'big')
+        second = int.from_bytes(digest[8:], 'big') | 1
+        for i in range(self.hash_count):
+            yield (first + i * second) % self.size
+
+    def add(self, key):
+        """Add a key to the filter."""
+
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self._bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(key))
+
+
+class LRUCache(object):
+
+    """Bounded mapping that forgets the least recently used key first."""
+
+    def __init__(self, size):
+        self.size = size
+        self._keys = OrderedDict()
+
+    def add(self, key, value=True):
+        """Remember a key, evicting the oldest one when full."""
+
+        self._keys[key] = value
+        self._keys.move_to_end(key)
+        if len(self._keys) > self.size:
+            self._keys.popitem(last=False)
+
+    def get(self, key, default=None):
+        """Return the value of a key, marking it as recently used."""
+
+        if key not in self._keys:
+            return default
+        self._keys.move_to_end(key)
+        return self._keys[key]
+
+    def discard(self, key):
+        """Forget a key if it is cached."""
+
+        self._keys.pop(key, None)
+
+    def __contains__(self, key):
+        return self.get(key, False) is not False
+
+
+class RevocationCache(object):
+
+    """Answer token revocation checks without querying on every request."""
+
+    def __init__(self, app=None):
+        self._lock = threading.RLock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('REVOCATION_BLOOM_CAPACITY', 100000)
+        app.config.setdefault('REVOCATION_BLOOM_ERROR_RATE', 0.001)
+        app.config.setdefault('REVOCATION_LRU_SIZE', 10000)
+        app.config.setdefault('REVOCATION_REFRESH_SECONDS', 5)
+        self.capacity = app.config['REVOCATION_BLOOM_CAPACITY']
+        self.error_rate = app.config['REVOCATION_BLOOM_ERROR_RATE']
+        self.lru_size = app.config['REVOCATION_LRU_SIZE']
+        self.refresh_seconds = app.config['REVOCATION_REFRESH_SECONDS']
+        app.config.setdefault('REVOCATION_REFRESH_MARGIN', 1000)
+        self.refresh_margin = app.config['REVOCATION_REFRESH_MARGIN']
+        app.config.setdefault('JWT_REVOCATION_MODE', 'blacklist')
+        app.config.setdefault('REVOCATION_EPOCH_TTL', 5)
+        self.epoch_mode = app.config['JWT_REVOCATION_MODE'] == 'epoch'
+        self.epoch_ttl = app.config['REVOCATION_EPOCH_TTL']
+        self.reset()
+
+        app.config.setdefault('REVOKED_TOKEN_PRUNE_INTERVAL', None)
+        app.config.setdefault('REVOKED_TOKEN_PRUNE_BATCH_SIZE', 1000)
+        if app.config['REVOKED_TOKEN_PRUNE_INTERVAL']:
+            self.start_pruning(
+                app, app.config['REVOKED_TOKEN_PRUNE_INTERVAL'],
+                app.config['REVOKED_TOKEN_PRUNE_BATCH_SIZE'])
+
+    @staticmethod
+    def start_pruning(app, interval, batch_size):
+        """Delete expired revoked tokens every `interval` seconds.
+
+        Args:
+            app(Flask): application providing the database configuration.
+            interval(int): seconds between two pruning runs.
+            batch_size(int): maximum number of rows deleted per transaction.
+
+        Returns:
+            The started daemon thread.
+        """
+        def prune():
+            while True:
+                time.sleep(interval)
+                with app.app_context():
+                    try:
+                        deleted = RevokedToken.prune_expired(batch_size)
+                        if deleted:
+                            logger.info(
+                                'Pruned %d expired revoked tokens', deleted)
+                    except Exception:
+                        db.session.rollback()
+                        logger.exception('Pruning revoked tokens failed')
+                    finally:
+                        db.session.remove()
+
+        thread = threading.Thread(
+            target=prune, name='revoked-token-pruner', daemon=True)
+        thread.start()
+        return thread
+
+    def reset(self):
+        """Forget every cached revocation, they are reloaded on next use."""
+
+        with self._lock:
+            self.bloom = None
+            self.confirmed = LRUCache(self.lru_size)
+            self.epochs = LRUCache(self.lru_size)
+            self.last_tid = 0
+            self.recent_tids = set()
+            self.refreshed_at = 0
+
+    def is_token_revoked(self, decrypted_token):
+        """Check whether a decoded token was revoked.
+
+        Args:
+            decrypted_token(dict): claims of the token.
+
+        Returns:
+            Boolean value.
+        """
+        claims = decrypted_token.get(
+            current_app.config['JWT_USER_CLAIMS']) or {}
+        if self.epoch_mode and 'ver' in claims:
+            return claims['ver'] < self.user_epoch(
+                decrypted_token[current_app.config['JWT_IDENTITY_CLAIM']])
+        return self.is_revoked(decrypted_token['jti'])
+
+    def revoke_token(self, raw_token):
+        """Revoke a token presented at logout.
+
+        Access tokens carrying a token version bump the owner's epoch in
+        epoch mode, any other token is added to the revoked_tokens table.
+
+        Args:
+            raw_token(dict): claims of the token.
+        """
+        claims = raw_token.get(current_app.config['JWT_USER_CLAIMS']) or {}
+        if self.epoch_mode and 'ver' in claims:
+            user_id = raw_token[current_app.config['JWT_IDENTITY_CLAIM']]
+            User.bump_token_version(user_id)
+            with self._lock:
+                self.epochs.discard(user_id)
+            return
+        # Tokens issued with JWT_ACCESS_TOKEN_EXPIRES = False have no exp
+        # claim and are kept until they are pruned by hand.
+        expires_at = raw_token.get('exp')
+        if expires_at is not None:
+            expires_at = datetime.utcfromtimestamp(expires_at)
+        RevokedToken(raw_token['jti'], expires_at).save()
+        self.revoke(raw_token['jti'])
+
+    def user_epoch(self, user_id):
+        """Return the current token version of a user.
+
+        Args:
+            user_id(int): id of the token owner.
+
+        Returns:
+            The token version, read from the database at most every
+            REVOCATION_EPOCH_TTL seconds.
+        """
+        now = time.time()
+        with self._lock:
+            cached = self.epochs.get(user_id)
+        if cached is not None and now - cached[1] < self.epoch_ttl:
+            return cached[0]
+        epoch = db.session.query(User.token_version).filter_by(
+            id=user_id).scalar() or 0
+        self.set_user_epoch(user_id, epoch, now)
+        return epoch
+
+    def set_user_epoch(self, user_id, epoch, loaded_at=None):
+        """Cache a token version that was just read from the database."""
+
+        with self._lock:
+            self.epochs.add(user_id, (epoch, loaded_at or time.time()))
+
+    def is_revoked(self, jti):
+        """Check whether a token identifier was revoked.
+
+        Args:
+            jti(str): A unique identifier of the token.
+
+        Returns:
+            Boolean value.
+        """
+        self.refresh()
+        with self._lock:
+            if jti not in self.bloom:
+                return False
+            if jti in self.confirmed:
+                return True
+        revoked = RevokedToken.is_jti_blacklisted(jti)
+        if revoked:
+            with self._lock:
+                self.confirmed.add(jti)
+        return revoked
+
+    def revoke(self, jti):
+        """Record a token revoked by this worker without waiting a refresh.
+
+        Args:
+            jti(str): A unique identifier of the token.
+        """
+        with self._lock:
+            if self.bloom is None:
+                return
+            self.bloom.add(jti)
+            self.confirmed.add(jti)
+
+    def refresh(self, force=False):
+        """Load revocations added since the last refresh.
+
+        The filter is rebuilt with twice the capacity once it holds more
+        keys than it was sized for, to keep the false positive rate down.
+        """
+        now = time.time()
+        with self._lock:
+            if not force and self.bloom is not None and \
+                    now - self.refreshed_at < self.refresh_seconds:
+                return
+            if self.bloom is None or self.bloom.count > self.bloom.capacity:
+                capacity = self.capacity
+                if self.bloom is not None:
+                    capacity = max(capacity, self.bloom.count * 2)
+                self.bloom = BloomFilter(capacity, self.error_rate)
+                self.last_tid = 0
+                self.recent_tids = set()
+
+            # A lower tid can commit after a higher one was loaded, look
+            # back over the margin and skip the tids already added.
+            low_tid = max(self.last_tid - self.refresh_margin, 0)
+            rows = db.session.query(
+                RevokedToken.tid, RevokedToken.jti).filter(
+                    RevokedToken.tid > low_tid).order_by(
+                        RevokedToken.tid).yield_per(1000)
+            for tid, jti in rows:
+                if tid in self.recent_tids:
+                    continue
+                self.bloom.add(jti)
+                self.recent_tids.add(tid)
+                self.last_tid = max(self.last_tid, tid)
+            low_tid = self.last_tid - self.refresh_margin
+            self.recent_tids = {
+                tid for tid in self.recent_tids if tid > low_tid}
+            self.refreshed_at = now
+
+
+revocation_cache = RevocationCache()
@@ -0,0 +1,785 @@
+"""In-process full-text and fuzzy search over registered businesses.
+
+This module keeps an inverted index of business name, category, location
+and summary tokens, and a trigram index of names and categories, in the
+memory of each worker. The indexes are built from the business table on
+first use (or loaded from the snapshot written by
+`python manage.py rebuild_search_index`) and kept up to date by the
+business views whenever a business is created, updated or deleted.
+
+Changes made by other workers and processes reach the indexes through a
+sync run by the first search after SEARCH_SYNC_SECONDS. It indexes again
+the businesses whose updated_at is past the last one seen, looking back
+SEARCH_SYNC_MARGIN seconds for transactions committed late, and drops
+the businesses that no longer exist.
+
+"""
+
+import heapq
+import math
+import os
+import pickle
+import re
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import timedelta
+
+from sqlalchemy import and_, or_
+
+from app.models import Business
+from app.models import db
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+# Term frequency multipliers, a match in the name counts more than one
+# buried in the summary.
+FIELD_WEIGHTS = (
+    ('name', 3),
+    ('category', 2),
+    ('location', 1),
+    ('summary', 1)
+)
+
+
+def tokenize(text):
+    """Split text into lowercase alphanumeric tokens.
+
+    Args:
+        text(str): text to tokenize.
+
+    Returns:
+        A list of tokens.
+    """
+    if not text:
+        return []
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class InvertedIndex(object):
+
+    """Posting lists of business ids keyed by token with BM25 ranking."""
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings = defaultdict(dict)
+        self._documents = {}
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self._documents)
+
+    def doc_ids(self):
+        """Return the set of indexed document ids."""
+
+        return set(self._documents)
+
+    def add(self, doc_id, fields):
+        """Index a document, replacing any previous version of it.
+
+        Args:
+            doc_id(int): unique document id.
+            fields(dict): field name to text mapping.
+        """
+        self.remove(doc_id)
+        frequencies = defaultdict(int)
+        length = 0
+        for field, weight in FIELD_WEIGHTS:
+            tokens = tokenize(fields.get(field))
+            length += len(tokens)
+            for token in tokens:
+                frequencies[token] += weight
+
+        for token, frequency in frequencies.items():
+            self._postings[token][doc_id] = frequency
+        self._documents[doc_id] = (length, tuple(frequencies))
+        self._total_length += length
+
+    def remove(self, doc_id):
+        """Drop a document from the index if it is indexed.
+
+        Args:
+            doc_id(int): unique document id.
+        """
+        document = self._documents.pop(doc_id, None)
+        if document is None:
+            return
+        length, tokens = document
+        self._total_length -= length
+        for token in tokens:
+            posting = self._postings[token]
+            posting.pop(doc_id, None)
+            if not posting:
+                del self._postings[token]
+
+    def search(self, query, operator='and', limit=None):
+        """Rank documents matching the query terms.
+
+        Args:
+            query(str): free text query.
+            operator(str): 'and' to require every term, 'or' for any term.
+            limit(int): maximum number of results, None for all.
+
+        Returns:
+            A list of (doc_id, score) tuples, best match first.
+        """
+        terms = list(set(tokenize(query)))
+        postings = [self._postings.get(term, {}) for term in terms]
+        if not postings:
+            return []
+
+        if operator == 'or':
+            candidates = set()
+            for posting in postings:
+                candidates.update(posting)
+        else:
+            # Intersect starting from the shortest posting list.
+            postings.sort(key=len)
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                if not candidates:
+                    break
+                candidates.intersection_update(posting)
+        if not candidates:
+            return []
+
+        document_count = len(self._documents)
+        average_length = float(self._total_length) / document_count or 1.0
+        scores = defaultdict(float)
+        for posting in postings:
+            idf = math.log(1 + (document_count - len(posting) + 0.5) /
+                           (len(posting) + 0.5))
+            for doc_id in candidates.intersection(posting):
+                frequency = posting[doc_id]
+                length = self._documents[doc_id][0]
+                norm = self.k1 * (
+                    1 - self.b + self.b * length / average_length)
+                scores[doc_id] += \
+                    idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        ranked = [(-score, doc_id) for doc_id, score in scores.items()]
+        if limit is None:
+            ranked.sort()
+        else:
+            ranked = heapq.nsmallest(limit, ranked)
+        return [(doc_id, -score) for score, doc_id in ranked]
+
+
+class TrigramIndex(object):
+
+    """Character trigram index over short field values for fuzzy lookups.
+
+    Each distinct lowercased value (a business name or category) is split
+    into padded word trigrams, as pg_trgm does, and the posting list of a
+    trigram holds the values containing it. Candidates are only drawn from
+    the rarest query trigrams that any match above the threshold must share,
+    so a lookup never compares the query with every value.
+    """
+
+    def __init__(self, fields=('name', 'category')):
+        self.fields = fields
+        self._postings = defaultdict(set)
+        self._values = {}
+        self._documents = {}
+
+    def __len__(self):
+        return len(self._documents)
+
+    @staticmethod
+    def trigrams(text):
+        """Return the set of padded word trigrams of a text."""
+
+        grams = set()
+        for word in tokenize(text):
+            padded = '  ' + word + ' '
+            grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+        return grams
+
+    def add(self, doc_id, fields):
+        """Index the configured fields of a document.
+
+        Args:
+            doc_id(int): unique document id.
+            fields(dict): field name to text mapping.
+        """
+        self.remove(doc_id)
+        values = tuple(set(
+            fields[field].lower() for field in self.fields
+            if fields.get(field)))
+        for value in values:
+            if value not in self._values:
+                grams = frozenset(self.trigrams(value))
+                if not grams:
+                    continue
+                self._values[value] = (grams, set())
+                for gram in grams:
+                    self._postings[gram].add(value)
+            self._values[value][1].add(doc_id)
+        self._documents[doc_id] = values
+
+    def remove(self, doc_id):
+        """Drop a document from the index if it is indexed.
+
+        Args:
+            doc_id(int): unique document id.
+        """
+        for value in self._documents.pop(doc_id, ()):
+            if value not in self._values:
+                continue
+            grams, doc_ids = self._values[value]
+            doc_ids.discard(doc_id)
+            if doc_ids:
+                continue
+            del self._values[value]
+            for gram in grams:
+                self._postings[gram].discard(value)
+                if not self._postings[gram]:
+                    del self._postings[gram]
+
+    def search(self, query, threshold, limit=None):
+        """Find documents whose values are similar to the query.
+
+        Similarity is the Jaccard index of the trigram sets. A value with
+        similarity >= threshold shares at least ceil(threshold * |query|)
+        trigrams with the query, so it must contain one of the
+        |query| - ceil(threshold * |query|) + 1 rarest query trigrams.
+
+        Args:
+            query(str): possibly misspelled text.
+            threshold(float): minimum similarity between 0 and 1.
+            limit(int): maximum number of results, None for all.
+
+        Returns:
+            A list of (doc_id, similarity) tuples, most similar first.
+        """
+        query_grams = sorted(
+            self.trigrams(query), key=lambda gram: len(
+                self._postings.get(gram, ())))
+        if not query_grams:
+            return []
+        required = max(1, int(math.ceil(threshold * len(query_grams))))
+        candidates = set()
+        for gram in query_grams[:len(query_grams) - required + 1]:
+            candidates.update(self._postings.get(gram, ()))
+
+        matches = []
+        query_set = frozenset(query_grams)
+        max_length = len(query_set) / threshold if threshold else None
+        for value in candidates:
+            grams = self._values[value][0]
+            if max_length is not None and len(grams) > max_length:
+                continue
+            shared = len(query_set & grams)
+            similarity = float(shared) / (
+                len(query_set) + len(grams) - shared)
+            if similarity >= threshold:
+                matches.append((-similarity, value))
+        matches.sort()
+
+        # A value such as a popular category can hold many documents, only
+        # expand as many of them as the caller asked for.
+        results = []
+        seen = set()
+        for similarity, value in matches:
+            doc_ids = self._values[value][1]
+            if limit is not None:
+                doc_ids = heapq.nsmallest(
+                    limit - len(results) + len(seen & doc_ids), doc_ids)
+            else:
+                doc_ids = sorted(doc_ids)
+            for doc_id in doc_ids:
+                if doc_id not in seen:
+                    seen.add(doc_id)
+                    results.append((doc_id, -similarity))
+            if limit is not None and len(results) >= limit:
+                return results[:limit]
+        return results
+
+
+class PrefixTrie(object):
+
+    """Sorted term arrays answering prefix completions with bisect.
+
+    Terms are kept in parallel lists sorted by their lowercased text, so
+    the completions of a prefix are a contiguous slice found with two
+    binary searches. The best `top_k` completions are ranked over that
+    slice, and cached for prefixes of at most `cached_prefix_length`
+    characters, whose slices are the longest.
+    """
+
+    def __init__(self, top_k=10, cached_prefix_length=2):
+        self.top_k = top_k
+        self.cached_prefix_length = cached_prefix_length
+        self._keys = []
+        self._terms = []
+        self._counts = array('l')
+        self._top = {}
+        self._pending = {}
+        self.deferred = False
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, term, delta=1):
+        """Change how many businesses use a term, removing it at zero.
+
+        Args:
+            term(str): completion text, matched case-insensitively.
+            delta(int): change of the term weight.
+        """
+        key = term.lower()
+        if self.deferred:
+            pending = self._pending.setdefault(key, [term, 0])
+            pending[1] += delta
+            return
+
+        position = bisect_left(self._keys, key)
+        if position < len(self._keys) and self._keys[position] == key:
+            term = self._terms[position]
+            count = max(self._counts[position] + delta, 0)
+            if count:
+                self._counts[position] = count
+            else:
+                del self._keys[position]
+                del self._terms[position]
+                del self._counts[position]
+        else:
+            count = max(delta, 0)
+            if not count:
+                return
+            # Lowercase terms share the string of their key.
+            term = key if term == key else term
+            self._keys.insert(position, key)
+            self._terms.insert(position, term)
+            self._counts.insert(position, count)
+
+        for length in range(self.cached_prefix_length + 1):
+            top = self._top.get(key[:length])
+            if top is None or len(key) < length:
+                continue
+            entries = [entry for entry in top if entry[1] != term]
+            if delta < 0 and len(entries) < len(top):
+                # A completion left the top, the next best one is only
+                # known after ranking the slice again.
+                del self._top[key[:length]]
+                continue
+            if count:
+                entries.append((-count, term))
+            self._top[key[:length]] = tuple(
+                heapq.nsmallest(self.top_k, entries))
+
+    def refresh(self):
+        """Merge the terms added in bulk and forget cached completions."""
+
+        if self._pending:
+            entries = {key: [term, count] for key, term, count in zip(
+                self._keys, self._terms, self._counts)}
+            for key, (term, delta) in self._pending.items():
+                entry = entries.setdefault(
+                    key, [key if term == key else term, 0])
+                entry[1] += delta
+            keys = sorted(key for key, (_, count) in entries.items()
+                          if count > 0)
+            self._keys = keys
+            self._terms = [entries[key][0] for key in keys]
+            self._counts = array('l', (entries[key][1] for key in keys))
+            self._pending = {}
+        self._top = {}
+        self.deferred = False
+
+    def complete(self, prefix, limit=None):
+        """Return the most used completions of a prefix.
+
+        Args:
+            prefix(str): text typed so far.
+            limit(int): maximum number of completions, at most top_k.
+
+        Returns:
+            A list of (term, count) tuples, most used first.
+        """
+        key = prefix.lower()
+        top = self._top.get(key)
+        if top is None:
+            low = bisect_left(self._keys, key)
+            high = bisect_left(self._keys, key + '\U0010ffff', low)
+            top = tuple(heapq.nsmallest(self.top_k, (
+                (-self._counts[position], self._terms[position])
+                for position in range(low, high))))
+            if len(key) <= self.cached_prefix_length:
+                self._top[key] = top
+        return [(term, -count) for count, term in top[:limit]]
+
+    def memory_usage(self):
+        """Estimate the bytes held by the term arrays and cached
+        completions."""
+
+        size = sum(sys.getsizeof(array) for array in (
+            self._keys, self._terms, self._counts, self._top, self._pending))
+        size += sum(sys.getsizeof(key) for key in self._keys)
+        size += sum(sys.getsizeof(term) for key, term in zip(
+            self._keys, self._terms) if term is not key)
+        for prefix, top in self._top.items():
+            size += sys.getsizeof(prefix) + sys.getsizeof(top)
+            size += sum(sys.getsizeof(entry) + sys.getsizeof(entry[0])
+                        for entry in top)
+        return size
+
+
+class SuggestionIndex(object):
+
+    """Prefix tries of business names, categories and locations."""
+
+    def __init__(self, fields=('name', 'category', 'location'), top_k=10):
+        self.tries = {field: PrefixTrie(top_k) for field in fields}
+        self._documents = {}
+
+    def __len__(self):
+        return len(self._documents)
+
+    def add(self, doc_id, fields):
+        """Add the field values of a document to the tries.
+
+        Args:
+            doc_id(int): unique document id.
+            fields(dict): field name to text mapping.
+        """
+        self.remove(doc_id)
+        values = tuple(
+            (field, fields[field]) for field in self.tries
+            if fields.get(field))
+        for field, value in values:
+            self.tries[field].add(value)
+        self._documents[doc_id] = values
+
+    def remove(self, doc_id):
+        """Remove the field values of a document from the tries.
+
+        Args:
+            doc_id(int): unique document id.
+        """
+        for field, value in self._documents.pop(doc_id, ()):
+            self.tries[field].add(value, -1)
+
+    def defer(self):
+        """Skip completion updates until refresh, for bulk loads."""
+
+        for trie in self.tries.values():
+            trie.deferred = True
+
+    def refresh(self):
+        """Recompute completions after a bulk load."""
+
+        for trie in self.tries.values():
+            trie.refresh()
+
+    def complete(self, prefix, limit=None):
+        """Return the top completions of a prefix for every field."""
+
+        return {field: trie.complete(prefix, limit)
+                for field, trie in self.tries.items()}
+
+    def memory_usage(self):
+        """Estimate the bytes held by the tries."""
+
+        return sum(trie.memory_usage() for trie in self.tries.values())
+
+
+def business_fields(business):
+    """Extract the searchable fields of a business record or row."""
+
+    return {field: getattr(business, field) for field, _ in FIELD_WEIGHTS}
+
+
+class BusinessSearch(object):
+
+    """Keep the in-process search indexes in sync with the business table."""
+
+    def __init__(self, app=None):
+        self._lock = threading.RLock()
+        # Held while indexes are built, searches meanwhile wait on it
+        # instead of starting a build of their own.
+        self._build_lock = threading.Lock()
+        self.reset()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SEARCH_INDEX_PATH', None)
+        app.config.setdefault('SEARCH_INDEX_BATCH_SIZE', 1000)
+        app.config.setdefault('SEARCH_FUZZY_THRESHOLD', 0.3)
+        app.config.setdefault('SEARCH_SUGGEST_TOP_K', 10)
+        app.config.setdefault('SEARCH_SYNC_SECONDS', 30)
+        app.config.setdefault('SEARCH_SYNC_MARGIN', 60)
+        self.snapshot_path = app.config['SEARCH_INDEX_PATH']
+        self.batch_size = app.config['SEARCH_INDEX_BATCH_SIZE']
+        self.fuzzy_threshold = app.config['SEARCH_FUZZY_THRESHOLD']
+        self.suggest_top_k = app.config['SEARCH_SUGGEST_TOP_K']
+        self.sync_seconds = app.config['SEARCH_SYNC_SECONDS']
+        self.sync_margin = timedelta(
+            seconds=app.config['SEARCH_SYNC_MARGIN'])
+        self.reset()
+
+    def reset(self):
+        """Forget the indexes, they are rebuilt on the next search."""
+
+        with self._lock:
+            self.indexes = None
+            self.changed_since = None
+            self.synced_at = 0
+            self._pending = None
+
+    def create_indexes(self):
+        """Return empty indexes keyed by name."""
+
+        return {
+            'text': InvertedIndex(),
+            'trigram': TrigramIndex(),
+            'suggest': SuggestionIndex(top_k=self.suggest_top_k)
+        }
+
+    def ensure_built(self):
+        """Load the snapshot or build the indexes from the database, and
+        sync them when the last sync is SEARCH_SYNC_SECONDS old."""
+
+        if self.indexes is not None:
+            if time.time() - self.synced_at >= self.sync_seconds:
+                self.sync(wait=False)
+            return
+        with self._build_lock:
+            if self.indexes is not None:
+                return
+            state = None
+            if self.snapshot_path and os.path.exists(self.snapshot_path):
+                with open(self.snapshot_path, 'rb') as snapshot:
+                    state = pickle.load(snapshot)
+            # Snapshots written before updated_at was tracked cannot be
+            # caught up.
+            if state is not None and 'changed_since' in state:
+                self._catch_up(state['indexes'], state['changed_since'])
+            else:
+                self._rebuild()
+
+    def sync(self, wait=True):
+        """Catch up on businesses changed or deleted by any process.
+
+        Args:
+            wait(bool): wait for a build or sync under way instead of
+                skipping this one.
+
+        Returns:
+            True when the indexes were synced.
+        """
+        if not self._build_lock.acquire(wait):
+            return False
+        try:
+            if self.indexes is None:
+                return False
+            self._catch_up(self.indexes, self.changed_since)
+            return True
+        finally:
+            self._build_lock.release()
+
+    def rebuild(self):
+        """Build new indexes from the business table in bulk.
+
+        Changes applied while the rebuild runs are replayed on the new
+        indexes before they replace the old ones.
+
+        Returns:
+            The number of indexed businesses.
+        """
+        with self._build_lock:
+            return self._rebuild()
+
+    def _rebuild(self):
+        started = time.time()
+        with self._lock:
+            self._pending = []
+        indexes = self.create_indexes()
+        changed_since = self._load_rows(indexes)
+        with self._lock:
+            for action, business_id, fields in self._pending:
+                self._update(indexes, action, business_id, fields)
+            self._pending = None
+            self.indexes = indexes
+            self.changed_since = changed_since
+            self.synced_at = started
+        return len(indexes['text'])
+
+    def save_snapshot(self, path=None):
+        """Write the indexes to disk so that workers can load them."""
+
+        self.ensure_built()
+        with self._lock, open(path or self.snapshot_path, 'wb') as snapshot:
+            pickle.dump({'indexes': self.indexes,
+                         'changed_since': self.changed_since},
+                        snapshot, pickle.HIGHEST_PROTOCOL)
+
+    def add_business(self, business):
+        """Index a created or updated business."""
+
+        self._apply('add', business.id, business_fields(business))
+
+    def remove_business(self, business_id):
+        """Drop a deleted business from the indexes."""
+
+        self._apply('remove', business_id, None)
+
+    def search(self, query, operator='and', limit=None):
+        """Rank businesses matching the query, see InvertedIndex.search."""
+
+        self.ensure_built()
+        with self._lock:
+            return self.indexes['text'].search(query, operator, limit)
+
+    def fuzzy_search(self, query, threshold=None, limit=None):
+        """Find businesses by a misspelled name or category.
+
+        Args:
+            query(str): possibly misspelled name or category.
+            threshold(float): minimum trigram similarity, defaults to
+                SEARCH_FUZZY_THRESHOLD.
+            limit(int): maximum number of results, None for all.
+
+        Returns:
+            A list of (business_id, similarity) tuples, best match first.
+        """
+        if threshold is None:
+            threshold = self.fuzzy_threshold
+        self.ensure_built()
+        with self._lock:
+            return self.indexes['trigram'].search(query, threshold, limit)
+
+    def suggest(self, prefix, limit=None):
+        """Complete a business name, category and location prefix.
+
+        Args:
+            prefix(str): text typed so far.
+            limit(int): maximum completions per field.
+
+        Returns:
+            A dictionary of field to list of (text, count) tuples.
+        """
+        self.ensure_built()
+        with self._lock:
+            return self.indexes['suggest'].complete(prefix, limit)
+
+    def stats(self):
+        """Report the size of the in-memory indexes."""
+
+        self.ensure_built()
+        with self._lock:
+            suggest = self.indexes['suggest']
+            return {
+                'businesses': len(self.indexes['text']),
+                'suggest_terms': {field: len(trie)
+                                  for field, trie in suggest.tries.items()},
+                'suggest_memory_bytes': suggest.memory_usage()
+            }
+
+    @staticmethod
+    def _update(indexes, action, business_id, fields):
+        for index in indexes.values():
+            if action == 'add':
+                index.add(business_id, fields)
+            else:
+                index.remove(business_id)
+
+    def _apply(self, action, business_id, fields):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((action, business_id, fields))
+            if self.indexes is None:
+                return
+            self._update(self.indexes, action, business_id, fields)
+
+    def _catch_up(self, indexes, changed_since):
+        """Index businesses changed since a marker and drop the deleted
+        ones, then serve the indexes."""
+
+        started = time.time()
+        latest = self._load_rows(
+            indexes, changed_since and changed_since - self.sync_margin)
+        self._drop_deleted(indexes)
+        with self._lock:
+            self.indexes = indexes
+            if latest is not None:
+                self.changed_since = max(latest, changed_since or latest)
+            else:
+                self.changed_since = changed_since
+            self.synced_at = started
+
+    def _drop_deleted(self, indexes):
+        """Remove the businesses that are no longer in the table."""
+
+        with self._lock:
+            indexed = indexes['text'].doc_ids()
+        # Every business is indexed after a catch up, so equal counts
+        # mean nothing was deleted.
+        if db.session.query(db.func.count(Business.id)).scalar() == \
+                len(indexed):
+            return
+        after_id = 0
+        while True:
+            ids = [business_id for business_id, in db.session.query(
+                Business.id).filter(Business.id > after_id).order_by(
+                    Business.id).limit(self.batch_size)]
+            indexed.difference_update(ids)
+            if len(ids) < self.batch_size:
+                break
+            after_id = ids[-1]
+        with self._lock:
+            for business_id in indexed:
+                self._update(indexes, 'remove', business_id, None)
+
+    def _load_rows(self, indexes, changed_since=None):
+        """Index business rows in updated_at order, a batch at a time.
+
+        Args:
+            indexes(dict): indexes to add the rows to.
+            changed_since(datetime): only index rows updated since then,
+                None for all rows in bulk.
+
+        Returns:
+            The updated_at of the last indexed business, None if none was
+            found.
+        """
+        columns = [Business.id, Business.updated_at] + [
+            getattr(Business, field) for field, _ in FIELD_WEIGHTS]
+        query = db.session.query(*columns).order_by(
+            Business.updated_at, Business.id)
+        deferred = []
+        if changed_since is None:
+            deferred = [index for index in indexes.values()
+                        if hasattr(index, 'defer')]
+        else:
+            query = query.filter(Business.updated_at >= changed_since)
+        for index in deferred:
+            index.defer()
+        last = None
+        while True:
+            batch = query
+            if last is not None:
+                batch = batch.filter(or_(
+                    Business.updated_at > last.updated_at,
+                    and_(Business.updated_at == last.updated_at,
+                         Business.id > last.id)))
+            rows = batch.limit(self.batch_size).all()
+            with self._lock:
+                for row in rows:
+                    self._update(
+                        indexes, 'add', row.id, business_fields(row))
+            if rows:
+                last = rows[-1]
+            if len(rows) < self.batch_size:
+                break
+        for index in deferred:
+            index.refresh()
+        return last.updated_at if last is not None else None
+
+
+business_search = BusinessSearch()
@@ -9,19 +9,21 @@ import re
 import os
 from itsdangerous import URLSafeTimedSerializer as Serializer
 
-from flask import Blueprint, request, make_response, jsonify
+from flask import Blueprint, request, make_response
 from flask_jwt_extended import (
     create_access_token, create_refresh_token, jwt_required,
     jwt_refresh_token_required, get_jwt_identity, get_raw_jwt
 )
 from flask_restful import (Resource, Api)
-from werkzeug.security import generate_password_hash
+from sqlalchemy.exc import IntegrityError
 
-from app.models import User, RevokedToken
+from app.encoding import jsonify, output_json
+from app.hashing import HasherBusy, password_hasher
+from app.models import User
 from app.models import db
+from app.revocation import revocation_cache
 from app.utils import (
-    email_exist, username_exist, valid_password, valid_email, check_key_error,
-    send_mail)
+    email_exist, valid_password, valid_email, check_key_error, send_mail)
 
 
 class RegisterUser(Resource):
@@ -86,8 +88,6 @@ class RegisterUser(Resource):
 
         if check_key_error(**user_data):
             return jsonify(check_key_error(**user_data))
-        not_valid_password = valid_password(password)
-        registered = username_exist(username) or email_exist(email)
         if not email or not username:
             response_message = jsonify({
                 'message': 'Email and Username are required!',
@@ -104,28 +104,39 @@ class RegisterUser(Resource):
                 'status_code': 406
             })
             return response_message
-        elif not_valid_password:
+        not_valid_password = valid_password(password)
+        if not_valid_password:
             response_message = jsonify(not_valid_password)
             response_message.status_code = 406
             return response_message
-        if not registered:
-            try:
-                user = User(email=email, username=username,
-                            password=password)
-                user.save()
-                response_message = jsonify({
-                    'message': 'You have successfully created an account!',
-                    'status_code': 201
-                })
-                return response_message
-            except Exception as error:
-                response_message = {'message': str(error)}
-                return make_response(jsonify(response_message))
-        else:
+
+        # The unique indexes on email and username reject a registered
+        # user, there is no separate lookup that a concurrent signup
+        # could race.
+        try:
+            user = User(email=email, username=username,
+                        password=password)
+            user.save()
+            response_message = jsonify({
+                'message': 'You have successfully created an account!',
+                'status_code': 201
+            })
+            return response_message
+        except IntegrityError:
+            db.session.rollback()
             response_message = jsonify({
                 'message': 'User already exists. Sign in!',
                 'status_code': 406})
             return response_message
+        except HasherBusy as error:
+            response_message = jsonify({
+                'message': str(error),
+                'status_code': 503})
+            response_message.status_code = 503
+            return response_message
+        except Exception as error:
+            response_message = {'message': str(error)}
+            return make_response(jsonify(response_message))
 
 
 class LoginUser(Resource):
@@ -186,16 +197,29 @@ class LoginUser(Resource):
         email = req_data.get('email')
         password = req_data.get('password')
 
-        if not email_exist(email):
+        user = db.session.query(
+            User.id, User.password, User.username,
+            User.token_version).filter_by(email=email).first()
+        if user is None:
             response = jsonify({
                 'response_message': 'Invalid email!',
                 'status_code': 401
             })
             return response
 
-        user = User.query.filter_by(email=email).first()
-        if email_exist(email) and user.check_password(password):
+        try:
+            password_matches = password_hasher.verify(user.password, password)
+        except HasherBusy as error:
+            response = jsonify({
+                'response_message': str(error),
+                'status_code': 503
+            })
+            response.status_code = 503
+            return response
+        if password_matches:
             try:
+                User.upgrade_password(user.id, user.password, password)
+                revocation_cache.set_user_epoch(user.id, user.token_version)
                 access_token = create_access_token(identity=user.id)
                 if access_token:
                     response = jsonify({
@@ -233,11 +257,10 @@ class UserLogoutAccess(Resource):
             200:
                 description: logout successfully
         """
-        jti = get_raw_jwt()['jti']
+        raw_token = get_raw_jwt()
 
         try:
-            revoked_token = RevokedToken(jti)
-            revoked_token.save()
+            revocation_cache.revoke_token(raw_token)
             response = jsonify({
                 'response_message': 'Log out has been successful!',
                 'status_code': 200
@@ -268,11 +291,10 @@ class UserLogoutRefresh(Resource):
             500:
                 description: Internal server error
         """
-        jti = get_raw_jwt()['jti']
+        raw_token = get_raw_jwt()
 
         try:
-            revoked_token = RevokedToken(jti)
-            revoked_token.save()
+            revocation_cache.revoke_token(raw_token)
             response = jsonify({
                 'response_message': 'Log out has been successful!',
                 'status_code': 200
@@ -450,7 +472,7 @@ class ResetPassword(Resource):
             user_email = serializer.loads(
                 token, salt='email-confirmation-salt', max_age=300)
             User.query.filter_by(email=user_email).update(dict(
-                password=generate_password_hash(password)))
+                password=password_hasher.hash(password)))
             db.session.commit()
 
             response = jsonify({
@@ -467,6 +489,7 @@ class ResetPassword(Resource):
 
 user_api = Blueprint('users.views', __name__)
 api = Api(user_api)
+api.representation('application/json')(output_json)
 api.add_resource(RegisterUser, '/register', endpoint='register')
 api.add_resource(LoginUser, '/login', endpoint='login')
 api.add_resource(TokenRefresh, '/refresh_token', endpoint='refresh_token')
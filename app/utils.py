@@ -1,14 +1,12 @@
 """Create helper functions to be used in views module."""
 
 import re
-import os
-from flask_mail import Message, Mail
+from flask import current_app, make_response, request
 
+from app.mailer import mail_queue
 from app.models import User
 from app.models import Business
 
-mail = Mail()
-
 
 def email_exist(email):
     """Check if user email is already registered."""
@@ -63,6 +61,23 @@ def valid_email(email):
     return valid
 
 
+def review_error(review):
+    """Validate the text of a business review.
+
+    Args:
+        review: review value sent by the client.
+
+    Returns:
+        An error message, None when the review is valid.
+    """
+    if not isinstance(review, str) or not review.strip():
+        return 'Review field is required!'
+    max_length = current_app.config['REVIEW_MAX_LENGTH']
+    if len(review) > max_length:
+        return 'Review must be at most {} characters!'.format(max_length)
+    return None
+
+
 def business_name_registered(name):
     """Check whether the business is already registered.
 
@@ -77,23 +92,60 @@ def business_name_registered(name):
     return registered
 
 
-def get_paginated_list(business_list, url, start, limit):
-    """Check whether the business is already registered.
+def escape_like(value):
+    """Escape LIKE wildcards so that user input is matched literally.
+
+    Args:
+        value(str): raw user input.
+
+    Returns:
+        The input with backslash, percent and underscore escaped.
+    """
+    return re.sub(r'([\\%_])', r'\\\1', value)
+
+
+def get_paginated_query(query, url, start, limit):
+    """Fetch one page of businesses using LIMIT/OFFSET in the database.
+
+    Only the requested page (plus one row to detect the next page) is read,
+    so the cost follows the page size rather than the number of matches.
+
+    Args:
+        query(Query): ordered query yielding (Business, username) rows.
+        url(str): API endpoint url
+        start(int): position of the first record, starting from 1
+        limit(int): maximum number of records in the page
+
+    Returns:
+        A dictionary of business records, `count` is the number of records
+        in the page.
+    """
+    rows = query.offset(start - 1).limit(limit + 1).all()
+    business_list = [
+        business_to_dict(business, user_name)
+        for business, user_name in rows[:limit]]
+
+    return get_paginated_page(
+        business_list, url, start, limit, len(rows) > limit)
+
+
+def get_paginated_page(business_list, url, start, limit, has_next):
+    """Wrap one page of business records with pagination links.
 
     Args:
-        business_list(list): a list of business recodes.
+        business_list(list): business records of the page.
         url(str): API endpoint url
-        start(int): beginning index of a list
-        limit(int): ending index of a list
+        start(int): position of the first record, starting from 1
+        limit(int): maximum number of records in the page
+        has_next(bool): whether records exist after this page
 
     Returns:
         A dictionary of business records.
     """
-    count = len(business_list)
     _object = {}
     _object['start'] = start
     _object['limit'] = limit
-    _object['count'] = count
+    _object['count'] = len(business_list)
 
     if start == 1:
         _object['previous'] = ''
@@ -103,16 +155,94 @@ def get_paginated_list(business_list, url, start, limit):
         _object['previous'] = \
             url + '?start=%d&limit=%d' % (start_copy, limit_copy)
 
-    if start + limit > count:
+    if not has_next:
         _object['next'] = ''
     else:
         start_copy = start + limit
         _object['next'] = url + '?start=%d&limit=%d' % (start_copy, limit)
-    _object['business_list'] = business_list[(start - 1):(start - 1 + limit)]
+    _object['business_list'] = business_list
 
     return _object
 
 
+def business_to_dict(business, user_name=None):
+    """Serialize a business record.
+
+    Args:
+        business(Business): business record.
+        user_name(str): username of the business owner.
+
+    Returns:
+        A dictionary of business attributes.
+    """
+    return {
+        'id': business.id,
+        'name': business.name,
+        'category': business.category,
+        'location': business.location,
+        'summary': business.summary,
+        'created_by': business.created_by,
+        'user_name': user_name
+    }
+
+
+def get_page_size(limit):
+    """Bound a requested page size by the configured maximum.
+
+    Args:
+        limit(int): requested number of records, None for the default.
+
+    Returns:
+        An integer between 1 and MAX_PAGE_SIZE.
+    """
+    if not limit or limit < 1:
+        return current_app.config['DEFAULT_PAGE_SIZE']
+    return min(limit, current_app.config['MAX_PAGE_SIZE'])
+
+
+def get_keyset_page(query, key_column, after_id, limit):
+    """Fetch one page of records ordered by a unique key.
+
+    The page is selected with `key > after_id` instead of an offset so the
+    cost of a page does not depend on how deep into the table it is.
+
+    Args:
+        query(Query): query to paginate, each row is a tuple whose first
+            element is the record owning `key_column`.
+        key_column(Column): unique, indexed column to order by.
+        after_id(int): last key seen by the client, None for the first page.
+        limit(int): maximum number of records in the page.
+
+    Returns:
+        A tuple of the page records and the cursor for the next page,
+        the cursor is None on the last page.
+    """
+    if after_id is not None:
+        query = query.filter(key_column > after_id)
+    rows = query.order_by(key_column).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, getattr(rows[-1][0], key_column.key)
+
+
+def not_modified(etag):
+    """Answer a conditional GET without building the body.
+
+    Args:
+        etag(str): strong entity tag of the current representation.
+
+    Returns:
+        An empty 304 response when the client sent a matching
+        If-None-Match header, None otherwise.
+    """
+    if not request.if_none_match.contains(etag):
+        return None
+    response = make_response('', 304)
+    response.set_etag(etag)
+    return response
+
+
 def check_key_error(**kwargs):
     error_message = {}
     for key in kwargs:
@@ -122,15 +252,11 @@ def check_key_error(**kwargs):
 
 
 def send_mail(user_email, body):
+    """Queue a password reset email, it is sent by the mail worker."""
+
     try:
-        message = Message(
-            subject='Forgot Password - weconnect.com',
-            sender=os.getenv('CONFIG_EMAIL'),
-            recipients=[user_email],
-            body=body
-            )
-
-        mail.send(message)
+        mail_queue.enqueue(
+            user_email, 'Forgot Password - weconnect.com', body)
         return 'Confirm your email'
     except Exception as error:
         return (str(error))
@@ -1,15 +1,22 @@
 """Define commands to run the server and migration."""
 
+import io
 import os
+import sys
+import time
 
 from flask_script import Manager
-from flask import redirect
+from flask import json, redirect
 from flask_migrate import Migrate, MigrateCommand
 
 from flasgger import Swagger
 
 from app import create_app
-from app.models import db
+from app.encoding import ENCODERS, orjson
+from app.models import db, RevokedToken
+from app.importer import FORMATS, BusinessImporter, read_records
+from app.mailer import mail_queue
+from app.search import business_search
 
 
 app = create_app(config_object=os.getenv('APP_SETTINGS'))
@@ -29,6 +36,140 @@ def index():
     return redirect('/apidocs')
 
 
+@manager.option('-o', '--output', dest='output', default=None,
+                help='Snapshot file, defaults to SEARCH_INDEX_PATH')
+def rebuild_search_index(output):
+    """Rebuild the business search index from the database."""
+
+    started = time.time()
+    count = business_search.rebuild()
+    print('Indexed {} businesses in {:.2f}s'.format(
+        count, time.time() - started))
+    stats = business_search.stats()
+    print('Suggestion tries hold {} terms in {:.1f} KiB'.format(
+        sum(stats['suggest_terms'].values()),
+        stats['suggest_memory_bytes'] / 1024.0))
+    output = output or app.config['SEARCH_INDEX_PATH']
+    if output:
+        business_search.save_snapshot(output)
+        print('Saved search index snapshot to {}'.format(output))
+
+
+@manager.option('-b', '--batch-size', dest='batch_size', type=int,
+                default=1000, help='Rows deleted per transaction')
+def prune_revoked_tokens(batch_size):
+    """Delete revoked tokens that are past their expiry."""
+
+    deleted = RevokedToken.prune_expired(batch_size)
+    print('Deleted {} expired revoked tokens'.format(deleted))
+
+
+@manager.option('-f', '--file', dest='path', required=True,
+                help='NDJSON or CSV file, - for standard input')
+@manager.option('-u', '--user-id', dest='user_id', type=int, required=True,
+                help='Id of the user owning the businesses')
+@manager.option('--format', dest='data_format', choices=FORMATS,
+                default=None, help='Defaults to the file extension')
+@manager.option('-c', '--chunk-size', dest='chunk_size', type=int,
+                default=None, help='Rows inserted per transaction')
+def import_businesses(path, user_id, data_format, chunk_size):
+    """Register businesses in bulk from an NDJSON or CSV file."""
+
+    if data_format is None:
+        data_format = 'csv' if path.lower().endswith('.csv') else 'ndjson'
+    importer = BusinessImporter(
+        user_id, chunk_size or app.config['BUSINESS_IMPORT_CHUNK_SIZE'])
+    started = time.time()
+    if path == '-':
+        stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8',
+                                  newline='')
+        report = importer.run(read_records(stream, data_format))
+    else:
+        with open(path, encoding='utf-8', newline='') as stream:
+            report = importer.run(read_records(stream, data_format))
+    for result in report['results']:
+        if result['status'] != 'created':
+            print('Row {}: {}'.format(
+                result['row'], result['response_message']))
+    print('Created {} businesses, skipped {} rows in {:.2f}s'.format(
+        report['created'], report['skipped'], time.time() - started))
+
+
+@manager.option('-i', '--interval', dest='interval', type=float,
+                default=None, help='Keep draining every INTERVAL seconds')
+@manager.option('-b', '--batch-size', dest='batch_size', type=int,
+                default=None, help='Messages sent per run')
+def process_mail_queue(interval, batch_size):
+    """Send the queued emails that are due."""
+
+    while True:
+        counts = mail_queue.process(batch_size)
+        if any(counts.values()) or interval is None:
+            print('Sent {sent}, retrying {retried}, failed {failed} '
+                  'emails'.format(**counts))
+            print('SMTP: {connections} connections, {reconnects} reconnects, '
+                  '{avg_send_ms} ms average and {max_send_ms} ms maximum '
+                  'per email, {messages_per_second} emails/s'.format(
+                      **mail_queue.pool.stats()))
+        if interval is None:
+            return
+        db.session.remove()
+        time.sleep(interval)
+
+
+@manager.option('-n', '--count', dest='count', type=int, default=10000,
+                help='Businesses in the encoded list')
+@manager.option('-r', '--rounds', dest='rounds', type=int, default=5,
+                help='Encodings timed per encoder')
+def benchmark_json(count, rounds):
+    """Time the JSON encoders on a business_list response."""
+
+    payload = {'business_list': [{
+        'id': index,
+        'name': 'Business {}'.format(index),
+        'category': 'technology',
+        'location': 'Nairobi',
+        'summary': 'AI is transforming human life, one café at a time',
+        'created_by': index % 50,
+        'user_name': 'user{}'.format(index % 50)
+    } for index in range(count)], 'limit': count, 'next_cursor': None}
+    for name, encoder_class in sorted(ENCODERS.items()):
+        if name == 'orjson' and orjson is None:
+            print('orjson: not installed')
+            continue
+        encoder = encoder_class()
+        started = time.perf_counter()
+        for _ in range(rounds):
+            size = len(encoder.dumps(payload))
+        print('{}: {:.2f} ms for {} businesses, {} bytes'.format(
+            name, 1000 * (time.perf_counter() - started) / rounds, count,
+            size))
+
+
+@manager.option('-e', '--email', dest='email', required=True,
+                help='Email of an existing account')
+@manager.option('-p', '--password', dest='password', required=True,
+                help='Password of the account')
+@manager.option('-n', '--count', dest='count', type=int, default=100,
+                help='Logins timed')
+def benchmark_login(email, password, count):
+    """Time logins of an existing account through the login endpoint."""
+
+    client = app.test_client()
+    login_data = json.dumps({'email': email, 'password': password})
+    started = time.perf_counter()
+    for _ in range(count):
+        response = client.post(
+            '/api/v2/auth/login', data=login_data,
+            headers={'Content-type': 'application/json'})
+        if 'access_token' not in json.loads(response.data.decode()):
+            print('Login failed: {}'.format(response.data.decode()))
+            return
+    seconds = time.perf_counter() - started
+    print('{} logins in {:.2f}s, {:.1f} logins/s'.format(
+        count, seconds, count / seconds))
+
+
 @manager.shell
 def make_shell_context():
     """Creates a python REPL"""
@@ -0,0 +1,29 @@
+"""Add case-insensitive unique indexes on users email and username
+
+Revision ID: 2c8d5f1e9b47
+Revises: 7f4e2b8c1a56
+Create Date: 2026-10-17 14:02:55.904137
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '2c8d5f1e9b47'
+down_revision = '7f4e2b8c1a56'
+branch_labels = None
+depends_on = None
+
+COLUMNS = ('email', 'username')
+
+
+def upgrade():
+    for column in COLUMNS:
+        op.execute(
+            'CREATE UNIQUE INDEX ix_users_lower_{0} '
+            'ON users (lower({0}))'.format(column))
+
+
+def downgrade():
+    for column in COLUMNS:
+        op.drop_index('ix_users_lower_{}'.format(column), table_name='users')
@@ -0,0 +1,36 @@
+"""Add lowered prefix search indexes on business name, category, location
+
+Revision ID: 3b9f1c2d7e4a
+Revises: 66d005cc8286
+Create Date: 2026-10-17 09:12:41.518204
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '3b9f1c2d7e4a'
+down_revision = '66d005cc8286'
+branch_labels = None
+depends_on = None
+
+COLUMNS = ('name', 'category', 'location')
+
+
+def upgrade():
+    # text_pattern_ops lets Postgres use the index for LIKE 'prefix%'
+    # regardless of the database collation.
+    if op.get_bind().dialect.name == 'postgresql':
+        opclass = ' text_pattern_ops'
+    else:
+        opclass = ''
+    for column in COLUMNS:
+        op.execute(
+            'CREATE INDEX ix_business_lower_{0} '
+            'ON business (lower({0}){1})'.format(column, opclass))
+
+
+def downgrade():
+    for column in COLUMNS:
+        op.drop_index('ix_business_lower_{}'.format(column),
+                      table_name='business')
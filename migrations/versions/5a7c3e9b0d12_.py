@@ -0,0 +1,31 @@
+"""Add version and review_count to business
+
+Revision ID: 5a7c3e9b0d12
+Revises: c41d7b9e2a35
+Create Date: 2026-10-17 11:20:52.307716
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a7c3e9b0d12'
+down_revision = 'c41d7b9e2a35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('business', sa.Column(
+        'version', sa.Integer(), nullable=False, server_default='1'))
+    op.add_column('business', sa.Column(
+        'review_count', sa.Integer(), nullable=False, server_default='0'))
+    op.execute(
+        'UPDATE business SET review_count = (SELECT count(*) FROM reviews '
+        'WHERE reviews.review_for = business.id)')
+
+
+def downgrade():
+    op.drop_column('business', 'review_count')
+    op.drop_column('business', 'version')
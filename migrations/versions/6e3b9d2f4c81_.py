@@ -0,0 +1,31 @@
+"""Add (created_by, id) index to business and business_count to users
+
+Revision ID: 6e3b9d2f4c81
+Revises: a1f6c3e8d294
+Create Date: 2026-10-17 15:32:47.208415
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6e3b9d2f4c81'
+down_revision = 'a1f6c3e8d294'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_business_created_by_id', 'business',
+                    ['created_by', 'id'], unique=False)
+    op.add_column('users', sa.Column(
+        'business_count', sa.Integer(), nullable=False, server_default='0'))
+    op.execute(
+        'UPDATE users SET business_count = (SELECT count(*) FROM business '
+        'WHERE business.created_by = users.id)')
+
+
+def downgrade():
+    op.drop_column('users', 'business_count')
+    op.drop_index('ix_business_created_by_id', table_name='business')
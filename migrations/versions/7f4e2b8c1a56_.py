@@ -0,0 +1,43 @@
+"""Add mail_outbox table
+
+Revision ID: 7f4e2b8c1a56
+Revises: d93f0a4b6e27
+Create Date: 2026-10-17 13:21:07.318452
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7f4e2b8c1a56'
+down_revision = 'd93f0a4b6e27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'mail_outbox',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('recipient', sa.String(length=60), nullable=False),
+        sa.Column('subject', sa.String(length=120), nullable=False),
+        sa.Column('body', sa.Text(), nullable=False),
+        sa.Column('status', sa.String(length=10), nullable=False,
+                  server_default='pending'),
+        sa.Column('attempts', sa.Integer(), nullable=False,
+                  server_default='0'),
+        sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('sent_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_mail_outbox_status_next_attempt_at', 'mail_outbox',
+                    ['status', 'next_attempt_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_mail_outbox_status_next_attempt_at',
+                  table_name='mail_outbox')
+    op.drop_table('mail_outbox')
@@ -0,0 +1,45 @@
+"""Add unique jti index and expires_at to revoked_tokens
+
+Revision ID: 8e2a4d6c1f90
+Revises: 3b9f1c2d7e4a
+Create Date: 2026-10-17 10:03:27.194551
+
+"""
+from datetime import datetime, timedelta
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e2a4d6c1f90'
+down_revision = '3b9f1c2d7e4a'
+branch_labels = None
+depends_on = None
+
+# Tokens revoked before this migration carry no expiry, none of them
+# outlives the default 30 day refresh token lifetime.
+LEGACY_TOKEN_LIFETIME = timedelta(days=30)
+
+
+def upgrade():
+    op.execute(
+        'DELETE FROM revoked_tokens WHERE tid NOT IN '
+        '(SELECT MIN(tid) FROM revoked_tokens GROUP BY jti)')
+    op.add_column('revoked_tokens',
+                  sa.Column('expires_at', sa.DateTime(), nullable=True))
+    revoked_tokens = sa.table(
+        'revoked_tokens', sa.column('expires_at', sa.DateTime()))
+    op.execute(revoked_tokens.update().values(
+        expires_at=datetime.utcnow() + LEGACY_TOKEN_LIFETIME))
+    op.create_index(op.f('ix_revoked_tokens_jti'), 'revoked_tokens',
+                    ['jti'], unique=True)
+    op.create_index(op.f('ix_revoked_tokens_expires_at'), 'revoked_tokens',
+                    ['expires_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_revoked_tokens_expires_at'),
+                  table_name='revoked_tokens')
+    op.drop_index(op.f('ix_revoked_tokens_jti'), table_name='revoked_tokens')
+    op.drop_column('revoked_tokens', 'expires_at')
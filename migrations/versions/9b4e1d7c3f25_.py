@@ -0,0 +1,33 @@
+"""Add updated_at to business
+
+Revision ID: 9b4e1d7c3f25
+Revises: 6e3b9d2f4c81
+Create Date: 2026-10-17 19:12:40.836217
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b4e1d7c3f25'
+down_revision = '6e3b9d2f4c81'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('business',
+                  sa.Column('updated_at', sa.DateTime(), nullable=True))
+    # The application writes UTC times, the database clock may not.
+    business = sa.table('business', sa.column('updated_at', sa.DateTime()))
+    op.execute(business.update().values(updated_at=datetime.utcnow()))
+    op.create_index('ix_business_updated_at_id', 'business',
+                    ['updated_at', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_business_updated_at_id', table_name='business')
+    op.drop_column('business', 'updated_at')
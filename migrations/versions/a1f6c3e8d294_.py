@@ -0,0 +1,55 @@
+"""Cascade deletes of users and businesses to their children
+
+Revision ID: a1f6c3e8d294
+Revises: 2c8d5f1e9b47
+Create Date: 2026-10-17 14:48:12.662019
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'a1f6c3e8d294'
+down_revision = '2c8d5f1e9b47'
+branch_labels = None
+depends_on = None
+
+FOREIGN_KEYS = {
+    'business': (('created_by', 'users'),),
+    'reviews': (('review_for', 'business'), ('reviewed_by', 'users'))
+}
+# Names Postgres gave the unnamed constraints, SQLite reflects them
+# unnamed and batch mode names them with this convention.
+NAMING_CONVENTION = {'fk': '%(table_name)s_%(column_0_name)s_fkey'}
+
+
+def replace_foreign_keys(ondelete):
+    bind = op.get_bind()
+    if bind.dialect.name == 'sqlite':
+        # Recreating a table in batch mode must not cascade to its
+        # children.
+        bind.execute('PRAGMA foreign_keys=OFF')
+    for table, foreign_keys in FOREIGN_KEYS.items():
+        with op.batch_alter_table(
+                table, naming_convention=NAMING_CONVENTION) as batch_op:
+            for column, referent in foreign_keys:
+                name = '{}_{}_fkey'.format(table, column)
+                batch_op.drop_constraint(name, type_='foreignkey')
+                batch_op.create_foreign_key(
+                    name, referent, [column], ['id'], ondelete=ondelete)
+    if bind.dialect.name == 'sqlite':
+        # Batch mode cannot reflect expression indexes and drops them
+        # along with the old table.
+        for column in ('name', 'category', 'location'):
+            op.execute(
+                'CREATE INDEX IF NOT EXISTS ix_business_lower_{0} '
+                'ON business (lower({0}))'.format(column))
+        bind.execute('PRAGMA foreign_keys=ON')
+
+
+def upgrade():
+    replace_foreign_keys('CASCADE')
+
+
+def downgrade():
+    replace_foreign_keys(None)
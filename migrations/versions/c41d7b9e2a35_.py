@@ -0,0 +1,25 @@
+"""Add token_version to users
+
+Revision ID: c41d7b9e2a35
+Revises: 8e2a4d6c1f90
+Create Date: 2026-10-17 10:41:09.862113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41d7b9e2a35'
+down_revision = '8e2a4d6c1f90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column(
+        'token_version', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    op.drop_column('users', 'token_version')
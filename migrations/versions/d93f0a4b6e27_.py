@@ -0,0 +1,24 @@
+"""Add composite (review_for, id) index to reviews
+
+Revision ID: d93f0a4b6e27
+Revises: 5a7c3e9b0d12
+Create Date: 2026-10-17 11:58:34.640281
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd93f0a4b6e27'
+down_revision = '5a7c3e9b0d12'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_reviews_review_for_id', 'reviews',
+                    ['review_for', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_reviews_review_for_id', table_name='reviews')
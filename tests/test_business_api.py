@@ -1,10 +1,13 @@
 """Design test case to test user account related functionalities."""
 
+import gzip
 import unittest
+from unittest import mock
 
 from flask import json
-from app.models import db
+from app.models import db, Reviews
 from app import create_app
+from app.search import business_search
 
 
 class AbstractTest(unittest.TestCase):
@@ -65,6 +68,18 @@ class AbstractTest(unittest.TestCase):
             '/api/v2/businesses', data=business_data,
             headers=dict(Authorization='Bearer ' + access_token))
 
+    def register_businesses(self, access_token, count):
+        """Register `count` businesses with distinct names."""
+
+        for index in range(count):
+            business_data = json.dumps({
+                'name': 'Business {}'.format(index),
+                'category': 'Technology', 'location': 'Nairobi',
+                'summary': 'AI is transforming human life'})
+            self.run_app.post(
+                '/api/v2/businesses', data=business_data,
+                headers=dict(Authorization='Bearer ' + access_token))
+
     def tearDown(self):
         """Call after every test to remove the created table."""
 
@@ -197,6 +212,212 @@ class CreateBusinessesTest(AbstractTest):
         self.assertIn('mombasa', str(response.data))
 
 
+class BusinessListPaginationTest(AbstractTest):
+    """Test cases for keyset pagination of the businesses list."""
+
+    def test_first_page(self):
+        """Test the first page holds `limit` businesses and a cursor
+        using get request for Businesses class view."""
+        access_token = json.loads(
+            self.authenticate_user().data.decode())['access_token']
+        self.register_businesses(access_token, 3)
+
+        response = self.run_app.get(
+            '/api/v2/businesses?limit=2',
+            headers=dict(Authorization='Bearer ' + access_token))
+        json_res = json.loads(response.data.decode())
+
+        self.assertEqual(
+            [business['id'] for business in json_res['business_list']],
+            [1, 2])
+        self.assertEqual(json_res['next_cursor'], 2)
+        self.assertEqual(
+            json_res['business_list'][0]['user_name'], 'cosmas')
+
+    def test_last_page(self):
+        """Test the page after the cursor ends the listing
+        using get request for Businesses class view."""
+        access_token = json.loads(
+            self.authenticate_user().data.decode())['access_token']
+        self.register_businesses(access_token, 3)
+
+        response = self.run_app.get(
+            '/api/v2/businesses?after_id=2&limit=2',
+            headers=dict(Authorization='Bearer ' + access_token))
+        json_res = json.loads(response.data.decode())
+
+        self.assertEqual(
+            [business['id'] for business in json_res['business_list']], [3])
+        self.assertIsNone(json_res['next_cursor'])
+        self.assertEqual(json_res['next'], '')
+
+
+class BusinessBatchTest(AbstractTest):
+    """Test cases for fetching several businesses by id."""
+
+    def test_view_ids_in_order(self):
+        """Test businesses are returned in the requested order
+        using get request for Businesses class view."""
+        access_token = json.loads(
+            self.authenticate_user().data.decode())['access_token']
+        self.register_businesses(access_token, 3)
+
+        response = self.run_app.get(
+            '/api/v2/businesses?ids=3,9,1',
+            headers=dict(Authorization='Bearer ' + access_token))
+        json_res = json.loads(response.data.decode())
+
+        self.assertEqual(
+            [business['id'] for business in json_res['business_list']],
+            [3, 9, 1])
+        self.assertEqual(json_res['business_list'][0]['user_name'], 'cosmas')
+        self.assertEqual(json_res['business_list'][1]['status_code'], 404)
+
+    def test_view_ids_body(self):
+        """Test businesses are fetched from a list of ids in the body
+        using post request for BusinessBatch class view."""
+        access_token = json.loads(
+            self.authenticate_user().data.decode())['access_token']
+        self.register_businesses(access_token, 2)
+
+        response = self.run_app.post(
+            '/api/v2/businesses/batch', data=json.dumps({'ids': [2, 1]}),
+            headers=dict(Authorization='Bearer ' + access_token))
+        json_res = json.loads(response.data.decode())
+
+        self.assertEqual(
+            [business['name'] for business in json_res['business_list']],
+            ['Business 1', 'Business 0'])
+
+    def test_view_too_many_ids(self):
+        """Test the number of ids per request is capped
+        using get request for Businesses class view."""
+        access_token = json.loads(
+            self.authenticate_user().data.decode())['access_token']
+        self.app.config['BUSINESS_BATCH_MAX_IDS'] = 2
+
+        response = self.run_app.get(
+            '/api/v2/businesses?ids=1,2,3',
+            headers=dict(Authorization='Bearer ' + access_token))
+
+        self.assertEqual(
+            json.loads(response.data.decode())['status_code'], 406)
+
+
+class ImportBusinessesTest(AbstractTest):
+    """Test cases for registering businesses in bulk."""
+
+    def test_import_ndjson(self):
+        """Test every row of an NDJSON upload is reported
+        using post request for ImportBusinesses class view."""
+        access_token = json.loads(
+            self.authenticate_user().data.decode())['access_token']
+        self.register_business(access_token)
+        lines = [
+            json.dumps({'name': 'Business 0', 'category': 'Technology',
+                        'location': 'Nairobi', 'summary': 'AI'}),
+            'not json',
+            json.dumps({'name': 'Palmer Tech', 'category': 'Technology',
+                        'location': 'Nairobi', 'summary': 'IoT'}),
+            json.dumps({'name': 'Business 0', 'category': 'Technology',
+                        'location': 'Nairobi', 'summary': 'AI'}),
+            json.dumps({'name': 'Business 1', 'category': 'Technology'})]
+
+        response = self.run_app.post(
+            '/api/v2/businesses/import', data='\n'.join(lines),
+            content_type='application/x-ndjson',
+            headers=dict(Authorization='Bearer ' + access_token))
+        json_res = json.loads(response.data.decode())
+
+        self.assertEqual(json_res['created'], 1)
+        self.assertEqual(
+            [result['status'] for result in json_res['results']],
+            ['created', 'invalid', 'duplicate', 'duplicate', 'invalid'])
+        self.assertEqual(json_res['results'][0]['id'], 2)
+
+    def test_import_csv(self):
+        """Test imported CSV rows are registered and searchable
+        using post request for ImportBusinesses class view."""
+        access_token = json.loads(
+            self.authenticate_user().data.decode())['access_token']
+        self.app.config['BUSINESS_IMPORT_CHUNK_SIZE'] = 2
+        rows = ['name,category,location,summary'] + [
+            'Business {0},Technology,Nairobi,Cloud {0}'.format(index)
+            for index in range(5)]
+
+        response = self.run_app.post(
+            '/api/v2/businesses/import', data='\n'.join(rows),
+            content_type='text/csv',
+            headers=dict(Authorization='Bearer ' + access_token))
+        self.assertEqual(json.loads(response.data.decode())['created'], 5)
+
+        response = self.run_app.get(
+            '/api/v2/businesses/search?q=cloud&mode=ranked',
+            headers=dict(Authorization='Bearer ' + access_token))
+        self.assertEqual(
+            len(json.loads(response.data.decode())['business_list']), 5)
+
+        response = self.run_app.get(
+            '/api/v2/businesses/user/1?total=true',
+            headers=dict(Authorization='Bearer ' + access_token))
+        self.assertEqual(json.loads(response.data.decode())['total'], 5)
+
+
+class ExportBusinessesTest(AbstractTest):
+    """Test cases for streaming the business directory."""
+
+    def test_export_resume(self):
+        """Test the export restarts after the last received business
+        using get request for ExportBusinesses class view."""
+        access_token = json.loads(
+            self.authenticate_user().data.decode())['access_token']
+        self.register_businesses(access_token, 3)
+
+        response = self.run_app.get(
+            '/api/v2/businesses/export?after_id=1',
+            headers=dict(Authorization='Bearer ' + access_token))
+        lines = [json.loads(line)
+                 for line in response.data.decode().splitlines()]
+
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertEqual([line['id'] for line in lines], [2, 3])
+        self.assertEqual(lines[0]['user_name'], 'cosmas')
+
+    def test_export_gzip(self):
+        """Test the export is compressed when the client accepts gzip
+        using get request for ExportBusinesses class view."""
+        access_token = json.loads(
+            self.authenticate_user().data.decode())['access_token']
+        self.app.config['EXPORT_BATCH_SIZE'] = 2
+        self.register_businesses(access_token, 3)
+
+        response = self.run_app.get(
+            '/api/v2/businesses/export',
+            headers={'Authorization': 'Bearer ' + access_token,
+                     'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        lines = gzip.decompress(response.data).decode().splitlines()
+        self.assertEqual([json.loads(line)['name'] for line in lines],
+                         ['Business 0', 'Business 1', 'Business 2'])
+
+    def test_export_gzip_refused(self):
+        """Test the export is not compressed for a client refusing gzip
+        using get request for ExportBusinesses class view."""
+        access_token = json.loads(
+            self.authenticate_user().data.decode())['access_token']
+        self.register_businesses(access_token, 1)
+
+        response = self.run_app.get(
+            '/api/v2/businesses/export',
+            headers={'Authorization': 'Bearer ' + access_token,
+                     'Accept-Encoding': 'gzip;q=0, identity'})
+
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(json.loads(response.data.decode())['name'],
+                         'Business 0')
+
+
 class ViewBusinessTest(AbstractTest):
     """Test cases for viewing one business by business id."""
 
@@ -227,6 +448,31 @@ class ViewBusinessTest(AbstractTest):
 
         self.assertIn('mombasa', str(response.data))
 
+    def test_view_not_modified(self):
+        """Test a business is revalidated until it is updated
+        using get request for OneBusiness class view."""
+        access_token = json.loads(
+            self.authenticate_user().data.decode())['access_token']
+        headers = dict(Authorization='Bearer ' + access_token)
+        self.register_business(access_token)
+
+        response = self.run_app.get('/api/v2/businesses/1', headers=headers)
+        etag = response.headers['ETag']
+
+        headers['If-None-Match'] = etag
+        response = self.run_app.get('/api/v2/businesses/1', headers=headers)
+        self.assertEqual(response.status_code, 304)
+
+        new_data = json.dumps({
+            'name': 'Palmer Tech', 'category': 'Technology',
+            'location': 'Nairobi',
+            'summary': 'IoT is transforming human security'})
+        self.run_app.put(
+            '/api/v2/businesses/1', data=new_data, headers=headers)
+        response = self.run_app.get('/api/v2/businesses/1', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
 
 class ViewUserBusinessTest(AbstractTest):
     """Test cases for viewing one business by user id."""
@@ -261,6 +507,33 @@ class ViewUserBusinessTest(AbstractTest):
 
         self.assertIn('mombasa', str(response.data))
 
+    def test_view_paginated(self):
+        """Test every business of a user is listed a page at a time
+        with the total read from the user's business counter."""
+        user = json.loads(self.authenticate_user().data.decode())
+        headers = dict(Authorization='Bearer ' + user['access_token'])
+        self.register_businesses(user['access_token'], 4)
+        self.run_app.delete('/api/v2/businesses/2', headers=headers)
+
+        response = self.run_app.get(
+            '/api/v2/businesses/user/{}?limit=2&total=true'.format(
+                user['user_id']), headers=headers)
+        first_page = json.loads(response.data.decode())
+        self.assertEqual(
+            [business['id'] for business in first_page['business_list']],
+            [1, 3])
+        self.assertEqual(first_page['total'], 3)
+        self.assertEqual(first_page['business_list'][0]['user_name'],
+                         'cosmas')
+
+        response = self.run_app.get(first_page['next'], headers=headers)
+        second_page = json.loads(response.data.decode())
+        self.assertEqual(
+            [business['id'] for business in second_page['business_list']],
+            [4])
+        self.assertIsNone(second_page['next_cursor'])
+        self.assertNotIn('total', second_page)
+
 
 class UpdateBusinessTest(AbstractTest):
     """Test cases for updating a business."""
@@ -300,6 +573,87 @@ class UpdateBusinessTest(AbstractTest):
 
         self.assertIn('Nairobi', str(response.data))
 
+    def test_update_missing_field(self):
+        """Test update without every business field
+        using put request for OneBusiness class view."""
+        access_token = json.loads(
+            self.authenticate_user().data.decode())['access_token']
+        self.register_business(access_token)
+
+        response = self.run_app.put(
+            '/api/v2/businesses/1', data=json.dumps({'location': 'Nairobi'}),
+            headers=dict(Authorization='Bearer ' + access_token))
+
+        self.assertEqual(
+            json.loads(response.data.decode())['status_code'], 406)
+
+    def test_patch_successful(self):
+        """Test patch changes only the given fields
+        using patch request for OneBusiness class view."""
+        access_token = json.loads(
+            self.authenticate_user().data.decode())['access_token']
+        self.register_business(access_token)
+
+        response = self.run_app.patch(
+            '/api/v2/businesses/1', data=json.dumps({'location': 'Nairobi'}),
+            headers=dict(Authorization='Bearer ' + access_token))
+        data = json.loads(response.data.decode())['data']
+
+        self.assertEqual(data['location'], 'Nairobi')
+        self.assertEqual(data['name'], 'Palmer Tech')
+        self.assertEqual(data['user_name'], 'cosmas')
+
+    def test_patch_unregistered(self):
+        """Test patch unregistered business
+        using patch request for OneBusiness class view."""
+        access_token = json.loads(
+            self.authenticate_user().data.decode())['access_token']
+
+        response = self.run_app.patch(
+            '/api/v2/businesses/3', data=json.dumps({'location': 'Nairobi'}),
+            headers=dict(Authorization='Bearer ' + access_token))
+
+        self.assertEqual(
+            json.loads(response.data.decode())['status_code'], 404)
+
+    def other_user_token(self):
+        """Register and log in a user owning no business."""
+        user_data = json.dumps({
+            'email': 'other@andela.com', 'username': 'palmer',
+            'password': 'aNdela2018', 'confirm_password': 'aNdela2018'})
+        self.run_app.post(
+            '/api/v2/auth/register', data=user_data, headers=self.headers)
+        response = self.run_app.post(
+            '/api/v2/auth/login', data=user_data, headers=self.headers)
+        return json.loads(response.data.decode())['access_token']
+
+    def test_update_not_owner(self):
+        """Test only the owner can update or patch a business
+        using put and patch requests for OneBusiness class view."""
+        access_token = json.loads(
+            self.authenticate_user().data.decode())['access_token']
+        self.register_business(access_token)
+        headers = dict(Authorization='Bearer ' + self.other_user_token())
+
+        new_data = json.dumps({
+            'name': 'Palmer Tech', 'category': 'Technology',
+            'location': 'Nairobi', 'summary': 'Hijacked'})
+        response = self.run_app.put(
+            '/api/v2/businesses/1', data=new_data, headers=headers)
+        self.assertEqual(
+            json.loads(response.data.decode())['status_code'], 401)
+
+        response = self.run_app.patch(
+            '/api/v2/businesses/1', data=json.dumps({'location': 'Nairobi'}),
+            headers=headers)
+        self.assertEqual(
+            json.loads(response.data.decode())['status_code'], 401)
+
+        response = self.run_app.get(
+            '/api/v2/businesses/1',
+            headers=dict(Authorization='Bearer ' + access_token))
+        self.assertIn('Mombasa', str(response.data))
+
 
 class DeleteBusinessTest(AbstractTest):
     """Test cases for deleting a business."""
@@ -332,6 +686,25 @@ class DeleteBusinessTest(AbstractTest):
         self.assertEqual(
             json.loads(response.data.decode())['status_code'], 204)
 
+    def test_delete_cascades_reviews(self):
+        """Test the reviews of a deleted business are deleted with it
+        using delete request for OneBusiness class view."""
+        access_token = json.loads(
+            self.authenticate_user().data.decode())['access_token']
+        self.register_business(access_token)
+        for _ in range(3):
+            self.run_app.post(
+                '/api/v2/businesses/1/reviews',
+                data=json.dumps({'review': 'Great service'}),
+                headers=dict(Authorization='Bearer ' + access_token))
+
+        self.run_app.delete(
+            '/api/v2/businesses/1',
+            headers=dict(Authorization='Bearer ' + access_token))
+
+        with self.app.app_context():
+            self.assertEqual(Reviews.query.count(), 0)
+
 
 class BusinessCategoryTest(AbstractTest):
     """Test suite for testing filtering business by category."""
@@ -427,6 +800,36 @@ class BusinessSearchTest(AbstractTest):
 
         self.assertIn('mombasa', str(response.data))
 
+    def test_search_case_insensitive(self):
+        """Test search matches the business name prefix in any case
+        using query string in SearchBusiness class view."""
+        access_token = json.loads(
+            self.authenticate_user().data.decode())['access_token']
+        self.register_business(access_token)
+
+        response = self.run_app.get(
+            '/api/v2/businesses/search?q=pALMER&start=1&limit=2',
+            headers=dict(Authorization='Bearer ' + access_token))
+
+        self.assertEqual(
+            json.loads(response.data.decode())['business_list'][0]['name'],
+            'Palmer Tech')
+
+    def test_search_wildcard_literal(self):
+        """Test LIKE wildcards in the query are matched literally
+        using query string in SearchBusiness class view."""
+        access_token = json.loads(
+            self.authenticate_user().data.decode())['access_token']
+        self.register_business(access_token)
+
+        response = self.run_app.get(
+            '/api/v2/businesses/search?q=%25&start=1&limit=2',
+            headers=dict(Authorization='Bearer ' + access_token))
+
+        self.assertEqual(
+            json.loads(response.data.decode())['response_message'],
+            'Business not found!')
+
     def test_pagination_api(self):
         """Test business results pagination
         using query string in SearchBusiness class view."""
@@ -457,5 +860,130 @@ class BusinessSearchTest(AbstractTest):
             len(json.loads(response.data.decode()).get('business_list')), 2)
 
 
+class RankedSearchTest(AbstractTest):
+    """Test suite for ranked full-text business search."""
+
+    def test_search_summary(self):
+        """Test ranked search matches words in the business summary
+        using query string in SearchBusiness class view."""
+        access_token = json.loads(
+            self.authenticate_user().data.decode())['access_token']
+        self.register_business(access_token)
+
+        response = self.run_app.get(
+            '/api/v2/businesses/search?q=human+security&mode=ranked',
+            headers=dict(Authorization='Bearer ' + access_token))
+
+        business_list = json.loads(response.data.decode())['business_list']
+        self.assertEqual(business_list[0]['name'], 'Palmer Tech')
+        self.assertIn('score', business_list[0])
+
+    def test_search_after_update(self):
+        """Test the ranked search index follows business updates
+        using query string in SearchBusiness class view."""
+        access_token = json.loads(
+            self.authenticate_user().data.decode())['access_token']
+        self.register_business(access_token)
+        self.run_app.get(
+            '/api/v2/businesses/search?q=palmer&mode=ranked',
+            headers=dict(Authorization='Bearer ' + access_token))
+
+        new_data = json.dumps({
+            'name': 'Palmer Tech', 'category': 'Technology',
+            'location': 'Kisumu', 'summary': 'Drones for farmers'})
+        self.run_app.put(
+            '/api/v2/businesses/1', data=new_data,
+            headers=dict(Authorization='Bearer ' + access_token))
+
+        response = self.run_app.get(
+            '/api/v2/businesses/search?q=drones&mode=ranked',
+            headers=dict(Authorization='Bearer ' + access_token))
+        self.assertIn('Kisumu', str(response.data))
+
+        response = self.run_app.get(
+            '/api/v2/businesses/search?q=security&mode=ranked',
+            headers=dict(Authorization='Bearer ' + access_token))
+        self.assertEqual(
+            json.loads(response.data.decode())['response_message'],
+            'Business not found!')
+
+    def test_fuzzy_search(self):
+        """Test fuzzy search finds a misspelled business name
+        using query string in SearchBusiness class view."""
+        access_token = json.loads(
+            self.authenticate_user().data.decode())['access_token']
+        self.register_business(access_token)
+
+        response = self.run_app.get(
+            '/api/v2/businesses/search?q=palmr+tech&mode=fuzzy',
+            headers=dict(Authorization='Bearer ' + access_token))
+
+        self.assertEqual(
+            json.loads(response.data.decode())['business_list'][0]['name'],
+            'Palmer Tech')
+
+    def test_search_index_error(self):
+        """Test a failing search index is reported as a JSON error
+        using query string in SearchBusiness class view."""
+        access_token = json.loads(
+            self.authenticate_user().data.decode())['access_token']
+
+        with mock.patch.object(business_search, 'search',
+                               side_effect=RuntimeError('Index failed!')):
+            response = self.run_app.get(
+                '/api/v2/businesses/search?q=palmer&mode=ranked',
+                headers=dict(Authorization='Bearer ' + access_token))
+
+        self.assertEqual(json.loads(response.data.decode()), {
+            'response_message': 'Index failed!', 'status_code': 500})
+
+
+class SuggestBusinessTest(AbstractTest):
+    """Test suite for business autocomplete suggestions."""
+
+    def test_suggest_successful(self):
+        """Test suggestions complete names, categories and locations
+        using query string in SuggestBusiness class view."""
+        access_token = json.loads(
+            self.authenticate_user().data.decode())['access_token']
+        self.register_business(access_token)
+
+        response = self.run_app.get(
+            '/api/v2/businesses/suggest?q=p',
+            headers=dict(Authorization='Bearer ' + access_token))
+        suggestions = json.loads(response.data.decode())['suggestions']
+
+        self.assertEqual(suggestions['name'],
+                         [{'text': 'Palmer Tech', 'count': 1}])
+        self.assertEqual(suggestions['location'], [])
+
+    def test_suggest_null_query(self):
+        """Test suggestions require a query
+        using query string in SuggestBusiness class view."""
+        access_token = json.loads(
+            self.authenticate_user().data.decode())['access_token']
+
+        response = self.run_app.get(
+            '/api/v2/businesses/suggest?q=',
+            headers=dict(Authorization='Bearer ' + access_token))
+
+        self.assertEqual(
+            json.loads(response.data.decode())['status_code'], 406)
+
+    def test_suggest_invalid_limit(self):
+        """Test a negative limit falls back to the default page size
+        using query string in SuggestBusiness class view."""
+        access_token = json.loads(
+            self.authenticate_user().data.decode())['access_token']
+        self.register_businesses(access_token, 3)
+
+        response = self.run_app.get(
+            '/api/v2/businesses/suggest?q=b&limit=-1',
+            headers=dict(Authorization='Bearer ' + access_token))
+        suggestions = json.loads(response.data.decode())['suggestions']
+
+        self.assertEqual(len(suggestions['name']), 3)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,204 @@
+"""Design test cases for the database engine configuration."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from flask import json
+from flask_jwt_extended import create_access_token
+from sqlalchemy.engine.url import make_url
+
+from app import create_app
+from app.database import InstrumentedQueuePool
+from app.models import Business, db
+
+
+class DatabasePoolTest(unittest.TestCase):
+
+    """Illustrate test cases for the connection pool settings."""
+
+    def setUp(self):
+        """Call this before every test."""
+
+        self.app = create_app(config_object="testing")
+        self.run_app = self.app.test_client()
+        self.context = self.app.app_context()
+        self.context.push()
+        db.drop_all()
+        db.create_all()
+
+    def tearDown(self):
+        """Call after every test to remove the created table."""
+
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def test_postgres_timeouts(self):
+        """Test Postgres connections get the configured timeouts."""
+
+        self.app.config['DATABASE_STATEMENT_TIMEOUT'] = 5000
+        self.app.config['DATABASE_IDLE_IN_TRANSACTION_TIMEOUT'] = 0
+        options = {'pool_size': 2}
+        db.apply_driver_hacks(
+            self.app, make_url('postgresql://user@localhost/weconnect'),
+            options)
+
+        self.assertEqual(options['connect_args']['options'],
+                         '-c statement_timeout=5000 '
+                         '-c idle_in_transaction_session_timeout=0')
+        self.assertIs(options['pool_pre_ping'], True)
+        self.assertIs(options['poolclass'], InstrumentedQueuePool)
+        self.assertNotIn('connect_timeout', options['connect_args'])
+
+    def test_replica_connect_timeout(self):
+        """Test connecting to a replica gives up after a short timeout."""
+
+        replica_uri = 'postgresql://user@replica/weconnect'
+        app = create_app(config_object="testing")
+        app.config.update(
+            SQLALCHEMY_BINDS={'replica_1': replica_uri},
+            SQLALCHEMY_REPLICA_BINDS=['replica_1'],
+            REPLICA_CONNECT_TIMEOUT=3)
+        options = {}
+        db.apply_driver_hacks(app, make_url(replica_uri), options)
+
+        self.assertEqual(options['connect_args']['connect_timeout'], 3)
+
+    def test_pool_metrics(self):
+        """Test checkouts are measured and served by the metrics view."""
+
+        pool = db.engine.pool
+        self.assertIsInstance(pool, InstrumentedQueuePool)
+        self.assertEqual(pool.size(), self.app.config['SQLALCHEMY_POOL_SIZE'])
+        with db.engine.connect() as connection:
+            connection.execute('SELECT 1')
+            self.assertEqual(db.pool_stats()['checked_out'], 1)
+
+        response = self.run_app.get('/api/v2/metrics/db-pool')
+        self.assertEqual(response.status_code, 401)
+
+        response = self.run_app.get(
+            '/api/v2/metrics/db-pool', headers=dict(
+                Authorization='Bearer ' + create_access_token(identity=1)))
+        stats = json.loads(response.data.decode())['pool_stats']
+        self.assertGreaterEqual(stats['checkouts'], 2)
+        self.assertEqual(stats['peak_checked_out'], 1)
+        # The token check of the request itself holds a connection.
+        self.assertEqual(stats['checked_out'], 1)
+        self.assertEqual(stats['capacity'], pool.size() + pool._max_overflow)
+
+
+class ReplicaRoutingTest(unittest.TestCase):
+
+    """Illustrate test cases for reading from replicas."""
+
+    def setUp(self):
+        """Call this before every test."""
+
+        self.app = create_app(config_object="testing")
+        self.run_app = self.app.test_client()
+        self.headers = {
+            'Content-type': 'application/json', 'Accept': 'text/plain'}
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.app.config.update(
+            SQLALCHEMY_BINDS={
+                'replica_1': 'sqlite:///' + os.path.join(
+                    directory, 'replica.db'),
+                'replica_2': 'sqlite:///' + os.path.join(
+                    directory, 'missing', 'replica.db')},
+            SQLALCHEMY_REPLICA_BINDS=['replica_1', 'replica_2'])
+
+        with self.app.app_context():
+            db.drop_all(bind=None)
+            db.create_all(bind=None)
+            replica = db.get_engine(bind='replica_1')
+            db.Model.metadata.create_all(bind=replica)
+            replica.execute(Business.__table__.insert(), name='Replica Tech',
+                            category='technology', location='Nairobi',
+                            summary='Served by the replica')
+
+    def tearDown(self):
+        """Call after every test to remove the created table."""
+
+        with self.app.app_context():
+            db.drop_all(bind=None)
+
+    def get_business_names(self, access_token, last_write=None):
+        headers = dict(Authorization='Bearer ' + access_token)
+        if last_write is not None:
+            headers['X-Last-Write'] = last_write
+        response = self.run_app.get('/api/v2/businesses', headers=headers)
+        return [business['name'] for business in
+                json.loads(response.data.decode())['business_list']]
+
+    def login(self, email, username):
+        user_data = json.dumps({
+            'email': email, 'username': username, 'password': 'aNdela2018'})
+        self.run_app.post(
+            '/api/v2/auth/register', data=user_data, headers=self.headers)
+        response = self.run_app.post(
+            '/api/v2/auth/login', data=user_data, headers=self.headers)
+        return json.loads(response.data.decode())['access_token']
+
+    def add_business(self, access_token, name):
+        return self.run_app.post('/api/v2/businesses', data=json.dumps({
+            'name': name, 'category': 'Technology',
+            'location': 'Mombasa', 'summary': 'IoT'}),
+            headers=dict(Authorization='Bearer ' + access_token))
+
+    def test_reads_routed_to_replica(self):
+        """Test reads go to healthy replicas, except right after a write
+        of the same user or when every replica is down."""
+        access_token = self.login('test@andela.com', 'cosmas')
+        other_token = self.login('other@andela.com', 'palmer')
+        self.assertEqual(
+            self.get_business_names(access_token), ['Replica Tech'])
+
+        response = self.add_business(access_token, '')
+        self.assertEqual(
+            json.loads(response.data.decode())['status_code'], 406)
+        self.assertNotIn('X-Last-Write', response.headers)
+        self.assertEqual(
+            self.get_business_names(access_token), ['Replica Tech'])
+
+        response = self.add_business(access_token, 'Palmer Tech')
+        last_write = response.headers['X-Last-Write']
+        self.assertEqual(
+            self.get_business_names(access_token), ['Palmer Tech'])
+        self.assertEqual(
+            self.get_business_names(other_token), ['Replica Tech'])
+
+        # Another worker only knows of the write through the header.
+        self.app.extensions['recent_writers'].clear()
+        self.assertEqual(
+            self.get_business_names(access_token), ['Replica Tech'])
+        self.assertEqual(
+            self.get_business_names(access_token, last_write),
+            ['Palmer Tech'])
+        self.assertEqual(
+            self.get_business_names(other_token, last_write),
+            ['Replica Tech'])
+        self.assertEqual(
+            self.get_business_names(access_token, last_write + 'x'),
+            ['Replica Tech'])
+
+        self.app.config['REPLICA_READ_YOUR_WRITES_SECONDS'] = 0
+        for _ in range(2):
+            self.assertEqual(
+                self.get_business_names(access_token, last_write),
+                ['Replica Tech'])
+        with self.app.app_context():
+            router = db.get_router()
+            self.assertEqual(router.stats(),
+                             {'replica_1': True, 'replica_2': False})
+            router.eject('replica_1')
+
+        self.assertEqual(
+            self.get_business_names(access_token), ['Palmer Tech'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+"""Design test cases for the JSON response encoders."""
+
+import json
+import unittest
+from datetime import datetime
+
+from app import create_app
+from app.encoding import ENCODERS, jsonify, orjson
+
+
+def business_list(count):
+    """Build a business_list payload of `count` businesses."""
+
+    return {'business_list': [{
+        'id': index,
+        'name': 'Business {}'.format(index),
+        'category': 'technology',
+        'location': 'Nairobi',
+        'summary': 'AI is transforming human life, one café at a time',
+        'created_by': index % 50,
+        'user_name': 'user{}'.format(index % 50)
+    } for index in range(count)], 'limit': count, 'next_cursor': None}
+
+
+class ResponseEncoderTest(unittest.TestCase):
+
+    """Illustrate test cases for encoding response bodies."""
+
+    def setUp(self):
+        """Call this before every test."""
+
+        self.app = create_app(config_object="testing")
+        self.context = self.app.app_context()
+        self.context.push()
+
+    def tearDown(self):
+        """Call after every test."""
+
+        self.context.pop()
+
+    def test_compact_response(self):
+        """Test responses are compact even in debug configurations."""
+
+        response = jsonify(response_message='Done', status_code=200)
+
+        self.assertTrue(self.app.debug)
+        self.assertEqual(response.mimetype, 'application/json')
+        self.assertEqual(
+            response.data,
+            b'{"response_message":"Done","status_code":200}')
+
+    def test_encoders_agree(self):
+        """Test every available encoder writes the same document."""
+
+        payload = business_list(3)
+        payload['created_at'] = datetime(2018, 5, 1, 12, 30)
+        documents = {
+            name: encoder(sort_keys=True).dumps(payload)
+            for name, encoder in ENCODERS.items()
+            if name != 'orjson' or orjson is not None}
+
+        self.assertEqual(len(set(documents.values())), 1)
+        self.assertEqual(
+            json.loads(documents['json'].decode())['created_at'],
+            'Tue, 01 May 2018 12:30:00 GMT')
+
+
+if __name__ == '__main__':
+    unittest.main()
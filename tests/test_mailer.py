@@ -0,0 +1,148 @@
+"""Design test cases for the outgoing mail queue."""
+
+import socket
+import unittest
+from datetime import datetime, timedelta
+
+from app import create_app
+from app.mailer import mail, mail_queue
+from app.models import OutboxMail
+from app.models import db
+
+try:
+    from aiosmtpd.controller import Controller
+except ImportError:
+    Controller = None
+
+
+class MailQueueTest(unittest.TestCase):
+
+    """Illustrate test cases for queueing and delivering emails."""
+
+    def setUp(self):
+        """Call this before every test."""
+
+        self.app = create_app(config_object="testing")
+        self.app.config['MAIL_DEFAULT_SENDER'] = 'noreply@weconnect.com'
+        self.context = self.app.app_context()
+        self.context.push()
+        db.drop_all()
+        db.create_all()
+
+    def tearDown(self):
+        """Call after every test to remove the created table."""
+
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def test_process_sends_due_mail(self):
+        """Test queued emails are sent once and marked as sent."""
+
+        mail_queue.enqueue('test@andela.com', 'Subject', 'Body')
+
+        with mail.record_messages() as outbox:
+            self.assertEqual(mail_queue.process()['sent'], 1)
+            self.assertEqual(mail_queue.process()['sent'], 0)
+
+        self.assertEqual([message.recipients for message in outbox],
+                         [['test@andela.com']])
+        self.assertEqual(OutboxMail.query.one().status, 'sent')
+
+    def test_failed_mail_backs_off(self):
+        """Test failed emails are retried later and eventually dropped."""
+
+        self.app.config['MAIL_DEFAULT_SENDER'] = None
+        self.app.config['MAIL_MAX_ATTEMPTS'] = 2
+        mail_queue.enqueue('test@andela.com', 'Subject', 'Body')
+        now = datetime.utcnow()
+
+        self.assertEqual(mail_queue.process(now=now)['retried'], 1)
+        message = OutboxMail.query.one()
+        self.assertEqual(message.attempts, 1)
+        self.assertEqual(message.next_attempt_at, now + timedelta(
+            seconds=self.app.config['MAIL_RETRY_BASE_SECONDS']))
+        self.assertEqual(mail_queue.process(now=now)['retried'], 0)
+
+        later = message.next_attempt_at
+        self.assertEqual(mail_queue.process(now=later)['failed'], 1)
+        self.assertEqual(OutboxMail.query.one().status, 'failed')
+
+    def test_no_transaction_while_sending(self):
+        """Test no database connection is held while the batch is sent."""
+
+        mail_queue.enqueue('test@andela.com', 'Subject', 'Body')
+        checked_out = []
+        send_batch = mail_queue.pool.send_batch
+
+        def record_send_batch(messages):
+            checked_out.append(db.engine.pool.checkedout())
+            return send_batch(messages)
+
+        mail_queue.pool.send_batch = record_send_batch
+        self.addCleanup(delattr, mail_queue.pool, 'send_batch')
+
+        with mail.record_messages():
+            self.assertEqual(mail_queue.process()['sent'], 1)
+        self.assertEqual(checked_out, [0])
+        self.assertEqual(OutboxMail.query.one().status, 'sent')
+
+    def start_smtp_server(self):
+        """Deliver the queue to a local SMTP server.
+
+        Returns:
+            A list receiving the recipients of every delivered email.
+        """
+        received = []
+
+        class Handler(object):
+            async def handle_DATA(self, server, session, envelope):
+                received.append(envelope.rcpt_tos)
+                return '250 Message accepted for delivery'
+
+        controller = Controller(Handler(), hostname='127.0.0.1')
+        controller.start()
+        self.addCleanup(controller.stop)
+        self.app.config.update(
+            MAIL_SERVER='127.0.0.1', MAIL_PORT=controller.port,
+            MAIL_USE_SSL=False, MAIL_USERNAME=None,
+            MAIL_SUPPRESS_SEND=False)
+        mail_queue.init_app(self.app)
+        self.addCleanup(mail_queue.pool.close_all)
+        return received
+
+    @unittest.skipIf(Controller is None, 'aiosmtpd is not installed')
+    def test_delivery_to_smtp_server(self):
+        """Test queued emails reach a local SMTP server."""
+
+        received = self.start_smtp_server()
+        for index in range(3):
+            mail_queue.enqueue(
+                'test{}@andela.com'.format(index), 'Subject', 'Body')
+
+        self.assertEqual(mail_queue.process()['sent'], 3)
+        self.assertEqual(len(received), 3)
+        stats = mail_queue.pool.stats()
+        self.assertEqual((stats['connections'], stats['batches']), (1, 1))
+
+    @unittest.skipIf(Controller is None, 'aiosmtpd is not installed')
+    def test_pooled_connection_reused(self):
+        """Test batches share a connection until the server drops it."""
+
+        self.start_smtp_server()
+        mail_queue.enqueue('test@andela.com', 'Subject', 'Body')
+        mail_queue.process()
+        mail_queue.enqueue('test@andela.com', 'Subject', 'Body')
+        mail_queue.process()
+        self.assertEqual(mail_queue.pool.stats()['connections'], 1)
+
+        connection, _ = mail_queue.pool._idle[0]
+        connection.host.sock.shutdown(socket.SHUT_RDWR)
+        mail_queue.enqueue('test@andela.com', 'Subject', 'Body')
+
+        self.assertEqual(mail_queue.process()['sent'], 1)
+        self.assertEqual(mail_queue.pool.stats()['connections'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -154,6 +154,115 @@ class BusinessReviewsTest(unittest.TestCase):
             'The future of AI is very bright, mostly in security',
             str(response.data))
 
+    def test_view_not_modified(self):
+        """Test reviews are revalidated until a new review is added
+        using get request for BusinessReviews class view."""
+
+        self.register_user()
+        login_response = self.login_user()
+        access_token = json.loads(login_response.data.decode())['access_token']
+        headers = dict(Authorization='Bearer ' + access_token)
+
+        self.register_business(access_token)
+        self.add_review(access_token)
+        response = self.run_app.get(
+            '/api/v2/businesses/1/reviews', headers=headers)
+        etag = response.headers['ETag']
+
+        headers['If-None-Match'] = etag
+        response = self.run_app.get(
+            '/api/v2/businesses/1/reviews', headers=headers)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+
+        self.add_review(access_token)
+        response = self.run_app.get(
+            '/api/v2/businesses/1/reviews', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_view_paginated(self):
+        """Test view business reviews one page at a time
+        using get request for BusinessReviews class view."""
+
+        self.register_user()
+        login_response = self.login_user()
+        access_token = json.loads(login_response.data.decode())['access_token']
+        headers = dict(Authorization='Bearer ' + access_token)
+
+        self.register_business(access_token)
+        for _ in range(3):
+            self.add_review(access_token)
+
+        response = self.run_app.get(
+            '/api/v2/businesses/1/reviews?limit=2', headers=headers)
+        data = json.loads(response.data.decode())
+        self.assertEqual([review['id'] for review in data['reviews_list']],
+                         [1, 2])
+        self.assertEqual(data['reviews_list'][0]['reviewer_username'],
+                         'cosmas')
+        self.assertEqual(data['total'], 3)
+        self.assertEqual(data['next_cursor'], 2)
+
+        response = self.run_app.get(data['next'], headers=headers)
+        data = json.loads(response.data.decode())
+        self.assertEqual([review['id'] for review in data['reviews_list']],
+                         [3])
+        self.assertIsNone(data['next_cursor'])
+
+    def test_add_batch(self):
+        """Test reviews are added in bulk with a status per review
+        using post request for BatchReviews class view."""
+
+        self.register_user()
+        login_response = self.login_user()
+        access_token = json.loads(login_response.data.decode())['access_token']
+        headers = dict(Authorization='Bearer ' + access_token)
+
+        self.register_business(access_token)
+        reviews = json.dumps({'reviews': [
+            {'business_id': 1, 'review': 'Great service'},
+            {'business_id': 7, 'review': 'Unknown business'},
+            {'business_id': 1},
+            {'business_id': 1, 'review': 'Fast delivery'}]})
+        response = self.run_app.post(
+            '/api/v2/reviews/batch', data=reviews, headers=headers)
+        data = json.loads(response.data.decode())
+
+        self.assertEqual(data['created'], 2)
+        self.assertEqual([result['status_code'] for result in data['results']],
+                         [201, 404, 406, 201])
+
+        response = self.run_app.get(
+            '/api/v2/businesses/1/reviews', headers=headers)
+        data = json.loads(response.data.decode())
+        self.assertEqual(data['total'], 2)
+        self.assertEqual([review['review'] for review in data['reviews_list']],
+                         ['Great service', 'Fast delivery'])
+
+    def test_add_batch_invalid_review(self):
+        """Test reviews that are not text or are too long are rejected
+        one by one using post request for BatchReviews class view."""
+
+        self.register_user()
+        login_response = self.login_user()
+        access_token = json.loads(login_response.data.decode())['access_token']
+        self.register_business(access_token)
+        max_length = self.app.config['REVIEW_MAX_LENGTH']
+        reviews = json.dumps({'reviews': [
+            {'business_id': 1, 'review': 42},
+            {'business_id': 1, 'review': 'x' * (max_length + 1)},
+            'not a review',
+            {'business_id': 1, 'review': 'Great service'}]})
+        response = self.run_app.post(
+            '/api/v2/reviews/batch', data=reviews,
+            headers=dict(Authorization='Bearer ' + access_token))
+        data = json.loads(response.data.decode())
+
+        self.assertEqual(data['created'], 1)
+        self.assertEqual([result['status_code'] for result in data['results']],
+                         [406, 406, 406, 201])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,142 @@
+"""Design test cases for the in-memory token revocation cache."""
+
+import unittest
+from datetime import datetime, timedelta
+
+from app import create_app
+from app.models import RevokedToken
+from app.models import db
+from app.revocation import BloomFilter, LRUCache, revocation_cache
+
+
+class BloomFilterTest(unittest.TestCase):
+
+    """Illustrate test cases for the revoked jti Bloom filter."""
+
+    def test_no_false_negatives(self):
+        """Test every added key is reported as present."""
+
+        bloom = BloomFilter(1000, 0.01)
+        keys = ['jti-{}'.format(index) for index in range(1000)]
+        for key in keys:
+            bloom.add(key)
+
+        self.assertTrue(all(key in bloom for key in keys))
+
+    def test_false_positive_rate(self):
+        """Test absent keys are rarely reported as present."""
+
+        bloom = BloomFilter(1000, 0.01)
+        for index in range(1000):
+            bloom.add('jti-{}'.format(index))
+
+        false_positives = sum(
+            'other-{}'.format(index) in bloom for index in range(10000))
+        self.assertLess(false_positives, 300)
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    """Illustrate test cases for the confirmed revocations cache."""
+
+    def test_evicts_least_recently_used(self):
+        """Test the oldest unused key is evicted first."""
+
+        cache = LRUCache(2)
+        cache.add('first')
+        cache.add('second')
+        self.assertIn('first', cache)
+        cache.add('third')
+
+        self.assertIn('first', cache)
+        self.assertNotIn('second', cache)
+        self.assertIn('third', cache)
+
+
+class PruneRevokedTokensTest(unittest.TestCase):
+
+    """Illustrate test cases for deleting expired revoked tokens."""
+
+    def setUp(self):
+        """Call this before every test."""
+
+        self.app = create_app(config_object="testing")
+        self.context = self.app.app_context()
+        self.context.push()
+        db.drop_all()
+        db.create_all()
+
+    def tearDown(self):
+        """Call after every test to remove the created table."""
+
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def test_prune_expired(self):
+        """Test only expired tokens are deleted, in several batches."""
+
+        now = datetime.utcnow()
+        for index in range(5):
+            RevokedToken('expired-{}'.format(index),
+                         now - timedelta(minutes=1)).save()
+        RevokedToken('active', now + timedelta(minutes=15)).save()
+        RevokedToken('no-expiry').save()
+
+        self.assertEqual(RevokedToken.prune_expired(batch_size=2), 5)
+        self.assertEqual(
+            [token.jti for token in RevokedToken.query.all()],
+            ['active', 'no-expiry'])
+
+
+class RevocationCacheTest(unittest.TestCase):
+
+    """Illustrate test cases for loading revocations into the cache."""
+
+    def setUp(self):
+        """Call this before every test."""
+
+        self.app = create_app(config_object="testing")
+        self.context = self.app.app_context()
+        self.context.push()
+        db.drop_all()
+        db.create_all()
+
+    def tearDown(self):
+        """Call after every test to remove the created table."""
+
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def save_token(self, tid, jti):
+        token = RevokedToken(jti)
+        token.tid = tid
+        token.save()
+
+    def test_refresh_loads_late_commits(self):
+        """Test a revocation committed after a higher tid was loaded
+        is picked up by the next refresh."""
+
+        self.save_token(1, 'first')
+        self.save_token(3, 'third')
+        revocation_cache.refresh(force=True)
+        self.assertEqual(revocation_cache.last_tid, 3)
+
+        self.save_token(2, 'second')
+        revocation_cache.refresh(force=True)
+
+        self.assertTrue(revocation_cache.is_revoked('second'))
+        self.assertEqual(revocation_cache.bloom.count, 3)
+
+    def test_revoke_token_without_expiry(self):
+        """Test tokens issued without an exp claim can be revoked."""
+
+        revocation_cache.revoke_token({'jti': 'forever', 'type': 'refresh'})
+
+        self.assertIsNone(RevokedToken.query.one().expires_at)
+        self.assertTrue(revocation_cache.is_revoked('forever'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,292 @@
+"""Design test cases for the in-process business search index."""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from random import Random
+from unittest import mock
+
+from app import create_app
+from app.models import Business, db
+from app.search import (
+    BusinessSearch, InvertedIndex, TrigramIndex, PrefixTrie, tokenize)
+
+
+class InvertedIndexTest(unittest.TestCase):
+
+    """Illustrate test cases for tokenizing and ranking documents."""
+
+    def setUp(self):
+        """Call this before every test."""
+
+        self.index = InvertedIndex()
+        self.index.add(1, {
+            'name': 'Palmer Tech', 'category': 'technology',
+            'location': 'Mombasa',
+            'summary': 'IoT is transforming human security'})
+        self.index.add(2, {
+            'name': 'Mombasa Grill', 'category': 'restaurant',
+            'location': 'Mombasa', 'summary': 'Seafood by the ocean'})
+        self.index.add(3, {
+            'name': 'Nairobi Bytes', 'category': 'technology',
+            'location': 'Nairobi', 'summary': 'Security audits'})
+
+    def test_tokenize(self):
+        """Test text is lowercased and split on non alphanumerics."""
+
+        self.assertEqual(tokenize('IoT-based, Security!'),
+                         ['iot', 'based', 'security'])
+
+    def test_and_query(self):
+        """Test an AND query only returns documents with every term."""
+
+        results = self.index.search('technology security')
+
+        self.assertEqual(sorted(doc_id for doc_id, _ in results), [1, 3])
+        self.assertEqual(self.index.search('grill technology'), [])
+
+    def test_or_query(self):
+        """Test an OR query returns documents with any term."""
+
+        results = self.index.search('grill technology', operator='or')
+
+        self.assertEqual(sorted(doc_id for doc_id, _ in results), [1, 2, 3])
+
+    def test_name_ranks_first(self):
+        """Test a match in the name outranks a match in the location."""
+
+        results = self.index.search('mombasa')
+
+        self.assertEqual(results[0][0], 2)
+
+    def test_update_and_remove(self):
+        """Test re-adding replaces a document and removing drops it."""
+
+        self.index.add(2, {
+            'name': 'Mombasa Grill', 'category': 'restaurant',
+            'location': 'Kisumu', 'summary': 'Fish by the lake'})
+        self.assertEqual(self.index.search('seafood'), [])
+        self.assertEqual(self.index.search('lake')[0][0], 2)
+
+        self.index.remove(2)
+        self.assertEqual(self.index.search('lake'), [])
+        self.assertEqual(len(self.index), 2)
+
+
+class TrigramIndexTest(unittest.TestCase):
+
+    """Illustrate test cases for typo tolerant lookups."""
+
+    def setUp(self):
+        """Call this before every test."""
+
+        self.index = TrigramIndex()
+        self.index.add(1, {'name': 'Mama Restaurant', 'category': 'food'})
+        self.index.add(2, {'name': 'Palmer Tech', 'category': 'technology'})
+        self.index.add(3, {'name': 'Java House', 'category': 'restaurant'})
+
+    def test_misspelled_query(self):
+        """Test a misspelled word still finds similar values."""
+
+        results = self.index.search('resturant', 0.3)
+
+        self.assertEqual(results[0][0], 3)
+        self.assertIn(1, [doc_id for doc_id, _ in results])
+        self.assertNotIn(2, [doc_id for doc_id, _ in results])
+
+    def test_threshold(self):
+        """Test a higher threshold drops weaker matches."""
+
+        results = self.index.search('resturant', 0.5)
+
+        self.assertEqual([doc_id for doc_id, _ in results], [3])
+
+    def test_remove(self):
+        """Test removed documents are no longer returned."""
+
+        self.index.remove(3)
+
+        self.assertEqual(
+            [doc_id for doc_id, _ in self.index.search('restaurant', 0.3)],
+            [1])
+
+
+class PrefixTrieTest(unittest.TestCase):
+
+    """Illustrate test cases for autocomplete suggestions."""
+
+    def setUp(self):
+        """Call this before every test."""
+
+        self.trie = PrefixTrie(top_k=2)
+        for term in ('Nairobi', 'Nakuru', 'Nakuru', 'Naivasha', 'Mombasa'):
+            self.trie.add(term)
+
+    def test_most_used_first(self):
+        """Test completions are ordered by usage and capped at top_k."""
+
+        self.assertEqual(self.trie.complete('na'),
+                         [('Nakuru', 2), ('Nairobi', 1)])
+        self.assertEqual(self.trie.complete('NAI'),
+                         [('Nairobi', 1), ('Naivasha', 1)])
+        self.assertEqual(self.trie.complete('x'), [])
+
+    def test_remove(self):
+        """Test a term disappears once no business uses it."""
+
+        self.trie.add('Nairobi', -1)
+
+        self.assertEqual(self.trie.complete('nai'), [('Naivasha', 1)])
+        self.assertEqual(len(self.trie), 3)
+
+    def test_bulk_refresh(self):
+        """Test deferred bulk loads give the same completions."""
+
+        trie = PrefixTrie(top_k=2)
+        trie.deferred = True
+        for term in ('Nairobi', 'Nakuru', 'Nakuru', 'Naivasha', 'Mombasa'):
+            trie.add(term)
+        trie.refresh()
+
+        self.assertEqual(trie.complete('na'), self.trie.complete('na'))
+        self.assertGreater(trie.memory_usage(), 0)
+
+    def test_cached_prefixes_follow_updates(self):
+        """Test cached completions of short prefixes match a fresh
+        ranking after terms are added and removed."""
+
+        terms = ['Nairobi', 'Nakuru', 'Naivasha', 'Nanyuki', 'Narok',
+                 'Mombasa', 'Malindi']
+        counts = dict.fromkeys(terms, 0)
+        random = Random(7)
+        trie = PrefixTrie(top_k=2)
+        for term in terms:
+            trie.complete(term[:2])
+        for _ in range(300):
+            term = random.choice(terms)
+            delta = random.choice((1, 1, -1))
+            trie.add(term, delta)
+            counts[term] = max(counts[term] + delta, 0)
+            for prefix in ('', 'n', 'na', 'nai', 'm'):
+                expected = sorted(
+                    (-counts[term], term) for term in terms
+                    if counts[term] and term.lower().startswith(prefix))
+                self.assertEqual(
+                    trie.complete(prefix),
+                    [(term, -count) for count, term in expected[:2]])
+
+
+class BusinessSearchTest(unittest.TestCase):
+
+    """Illustrate test cases for building the business indexes."""
+
+    def setUp(self):
+        """Call this before every test."""
+
+        self.app = create_app(config_object="testing")
+        self.search = BusinessSearch(self.app)
+
+    def test_concurrent_first_search(self):
+        """Test searches racing on an empty index build it once."""
+
+        def slow_load_rows(indexes, changed_since=None):
+            time.sleep(0.1)
+            self.search._update(indexes, 'add', 1, {
+                'name': 'Palmer Tech', 'category': 'technology',
+                'location': 'Mombasa', 'summary': 'IoT'})
+
+        results, errors = [], []
+
+        def run_search():
+            try:
+                results.append(self.search.search('palmer'))
+            except Exception as e:
+                errors.append(e)
+
+        with mock.patch.object(self.search, '_load_rows',
+                               side_effect=slow_load_rows) as load_rows:
+            threads = [threading.Thread(target=run_search)
+                       for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(load_rows.call_count, 1)
+        self.assertEqual([len(result) for result in results], [1] * 4)
+
+
+class BusinessSyncTest(unittest.TestCase):
+
+    """Illustrate test cases for catching up on changes of other
+    processes."""
+
+    def setUp(self):
+        """Call this before every test."""
+
+        self.app = create_app(config_object="testing")
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.app.config.update(
+            SEARCH_INDEX_PATH=os.path.join(directory, 'search.pickle'),
+            SEARCH_SYNC_MARGIN=0)
+        self.context = self.app.app_context()
+        self.context.push()
+        db.drop_all()
+        db.create_all()
+        Business('Palmer Tech', 'Technology', 'Mombasa', 'IoT', None).save()
+        Business('Mombasa Grill', 'Restaurant', 'Mombasa', 'Seafood',
+                 None).save()
+
+    def tearDown(self):
+        """Call after every test to remove the created table."""
+
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def change_businesses(self):
+        """Rename, delete and add businesses behind the indexes' back."""
+
+        Business.query.filter_by(name='Palmer Tech').update(
+            {Business.name: 'Kisumu Drones'}, synchronize_session=False)
+        Business.query.filter_by(name='Mombasa Grill').delete(
+            synchronize_session=False)
+        db.session.commit()
+        Business('Nairobi Bytes', 'Technology', 'Nairobi', 'Audits',
+                 None).save()
+
+    def assert_synced(self, search):
+        self.assertEqual(search.search('palmer'), [])
+        self.assertEqual(len(search.search('drones')), 1)
+        self.assertEqual(len(search.search('bytes')), 1)
+        self.assertEqual(len(search.search('grill')), 0)
+        self.assertEqual(search.fuzzy_search('palmr tech'), [])
+        self.assertEqual(search.suggest('mombasa g')['name'], [])
+
+    def test_snapshot_catch_up(self):
+        """Test a loaded snapshot catches up on changed and deleted rows."""
+
+        BusinessSearch(self.app).save_snapshot()
+        self.change_businesses()
+
+        self.assert_synced(BusinessSearch(self.app))
+
+    def test_periodic_sync(self):
+        """Test a running worker syncs with changes of other processes."""
+
+        search = BusinessSearch(self.app)
+        self.assertEqual(len(search.search('palmer')), 1)
+        self.change_businesses()
+        self.assertEqual(len(search.search('palmer')), 1)
+
+        search.sync_seconds = 0
+        self.assert_synced(search)
+
+
+if __name__ == '__main__':
+    unittest.main()
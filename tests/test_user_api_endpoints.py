@@ -5,14 +5,28 @@ are expected from user account authentication.
 
 """
 
+import time
 import unittest
+from unittest import mock
 
 from flask import json
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
 
-from app.models import db
+from app import hashing
+from app.hashing import password_hasher
+from app.models import db, RevokedToken, User
+from app.revocation import revocation_cache
 from app import create_app
 
 
+def slow_hash(password, method):
+    """Stand in for a password hash that outlasts the timeout."""
+
+    time.sleep(2)
+    return method
+
+
 class AbstractTest(unittest.TestCase):
     """Define methods to be used in all test suites."""
 
@@ -124,6 +138,20 @@ class RegisterUserTest(AbstractTest):
         json_res = json.loads(response.data.decode())
         self.assertEqual(json_res['message'], 'User already exists. Sign in!')
 
+    def test_unique_email_ignores_case(self):
+        """Test the database rejects an email differing only in case."""
+
+        self.run_app.post('/api/v2/auth/register',
+                          data=self.user_data, headers=self.headers)
+
+        with self.app.app_context():
+            users = User.__table__
+            with self.assertRaises(IntegrityError):
+                db.session.execute(users.insert().values(
+                    email='TEST2@andela.com', username='other',
+                    password='hash'))
+            db.session.rollback()
+
     def test_register_registered_name(self):
         """Test user registration with a registered username
         using post request for RegisterUser class view."""
@@ -276,6 +304,171 @@ class LogoutAccessTest(AbstractTest):
             json.loads(logout_res.data.decode())['response_message'],
             'Log out has been successful!')
 
+    def test_revoked_token_rejected(self):
+        """Test a logged out access token is rejected at once
+        using post request for UserLogoutAccess class view."""
+
+        self.run_app.post('/api/v2/auth/register', data=self.user_data,
+                          headers=self.headers)
+        login_data = json.dumps({'email': 'test2@andela.com',
+                                 'password': 'anDela2018'})
+        login_response = self.run_app.post('/api/v2/auth/login',
+                                           data=login_data,
+                                           headers=self.headers)
+        access_token = json.loads(login_response.data.decode())['access_token']
+        headers = dict(Authorization='Bearer ' + access_token)
+
+        response = self.run_app.get('/api/v2/businesses', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.run_app.post('/api/v2/auth/logout', headers=headers)
+
+        response = self.run_app.get('/api/v2/businesses', headers=headers)
+        self.assertEqual(response.status_code, 401)
+
+
+class EpochRevocationTest(AbstractTest):
+    """Test suite for logout with per-user token versions."""
+
+    def setUp(self):
+        """Switch the application to epoch revocation."""
+
+        super(EpochRevocationTest, self).setUp()
+        self.app.config['JWT_REVOCATION_MODE'] = 'epoch'
+        revocation_cache.init_app(self.app)
+
+    def login(self):
+        """Register and login, returning authorization headers."""
+
+        self.run_app.post('/api/v2/auth/register', data=self.user_data,
+                          headers=self.headers)
+        login_data = json.dumps({'email': 'test2@andela.com',
+                                 'password': 'anDela2018'})
+        login_response = self.run_app.post('/api/v2/auth/login',
+                                           data=login_data,
+                                           headers=self.headers)
+        access_token = json.loads(login_response.data.decode())['access_token']
+        return dict(Authorization='Bearer ' + access_token)
+
+    def test_logout_bumps_version(self):
+        """Test logout rejects the token without storing its jti
+        using post request for UserLogoutAccess class view."""
+
+        headers = self.login()
+        response = self.run_app.get('/api/v2/businesses', headers=headers)
+        self.assertEqual(response.status_code, 200)
+
+        self.run_app.post('/api/v2/auth/logout', headers=headers)
+
+        response = self.run_app.get('/api/v2/businesses', headers=headers)
+        self.assertEqual(response.status_code, 401)
+        with self.app.app_context():
+            self.assertEqual(RevokedToken.query.count(), 0)
+
+    def test_login_after_logout(self):
+        """Test a token issued after logout is accepted
+        using post request for LoginUser class view."""
+
+        self.run_app.post('/api/v2/auth/logout', headers=self.login())
+
+        response = self.run_app.get(
+            '/api/v2/businesses', headers=self.login())
+        self.assertEqual(response.status_code, 200)
+
+
+class PasswordHashingTest(AbstractTest):
+    """Test cases for hashing passwords outside the request thread."""
+
+    def login(self):
+        """Login the registered user."""
+
+        login_data = json.dumps({'email': 'test2@andela.com',
+                                 'password': 'anDela2018'})
+        return self.run_app.post('/api/v2/auth/login',
+                                 data=login_data, headers=self.headers)
+
+    def test_rehash_on_login(self):
+        """Test a hash made with old parameters is replaced at login
+        using post request for LoginUser class view."""
+
+        self.run_app.post('/api/v2/auth/register',
+                          data=self.user_data, headers=self.headers)
+        self.app.config['PASSWORD_HASH_ITERATIONS'] = 1000
+        password_hasher.init_app(self.app)
+
+        login_response = self.login()
+
+        self.assertEqual(
+            json.loads(login_response.data.decode())['status_code'], 200)
+        with self.app.app_context():
+            self.assertTrue(User.query.one().password.startswith(
+                'pbkdf2:sha256:1000$'))
+        self.assertEqual(
+            json.loads(self.login().data.decode())['status_code'], 200)
+
+    def test_login_with_process_pool(self):
+        """Test passwords hashed by worker processes can log in
+        using post request for LoginUser class view."""
+
+        self.app.config['PASSWORD_HASH_WORKERS'] = 1
+        password_hasher.init_app(self.app)
+        self.addCleanup(password_hasher.shutdown)
+
+        self.run_app.post('/api/v2/auth/register',
+                          data=self.user_data, headers=self.headers)
+        login_response = self.login()
+
+        self.assertEqual(
+            json.loads(login_response.data.decode())['status_code'], 200)
+
+    def test_slow_hash_reports_busy(self):
+        """Test a hash outlasting PASSWORD_HASH_TIMEOUT answers busy
+        using post request for RegisterUser class view."""
+
+        self.app.config.update(
+            PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_TIMEOUT=0.2)
+        password_hasher.init_app(self.app)
+        self.addCleanup(password_hasher.shutdown)
+
+        with mock.patch.object(hashing, 'generate_password_hash', slow_hash):
+            response = self.run_app.post('/api/v2/auth/register',
+                                         data=self.user_data,
+                                         headers=self.headers)
+
+        self.assertEqual(response.status_code, 503)
+
+
+class LoginStatementsTest(AbstractTest):
+    """Measure the database cost of the login endpoint."""
+
+    def test_login_single_statement(self):
+        """Test a login runs one SQL statement
+        using post request for LoginUser class view."""
+
+        self.app.config['PASSWORD_HASH_ITERATIONS'] = 1000
+        password_hasher.init_app(self.app)
+        self.run_app.post('/api/v2/auth/register',
+                          data=self.user_data, headers=self.headers)
+        login_data = json.dumps({'email': 'test2@andela.com',
+                                 'password': 'anDela2018'})
+        statements = []
+
+        def count_statement(*args):
+            statements.append(args[2])
+
+        with self.app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', count_statement)
+        self.addCleanup(event.remove, engine, 'before_cursor_execute',
+                        count_statement)
+
+        logins = 5
+        for _ in range(logins):
+            login_response = self.run_app.post(
+                '/api/v2/auth/login', data=login_data, headers=self.headers)
+            self.assertEqual(login_response.status_code, 200)
+
+        self.assertEqual(len(statements), logins)
+
 
 class ResetPasswordTest(AbstractTest):
     """Test suite for the reset password api endpoint."""